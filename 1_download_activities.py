@@ -1,91 +1,134 @@
-import requests
 import json
 import urllib3
 import os
 import sys
+from datetime import datetime, timezone
 import config
+import json_utils
+import strava_fetcher
+import transport
 
-# https://www.strava.com/settings/api
-if len(config.STRAVA_CLIENT_ID) == 0 or len(config.STRAVA_CLIENT_SECRET) == 0:
-    print("(!) Strava client ID or Strava client secret is missing")
-    sys.exit(1)
+# Incremental sync: the date of the most recent activity already downloaded is kept in
+# raw_activities/sync_state.json, and only newer activities are requested with the API's `after` parameter.
+# New activities are appended as new activities_page_N.json files, existing files are never overwritten.
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Authorization URL
-auth_url = (
-    f'https://www.strava.com/oauth/authorize?client_id={config.STRAVA_CLIENT_ID}&'
-    'redirect_uri=http://127.0.0.1&response_type=code&scope=activity:read_all&approval_prompt=auto'
-)
+RAW_ACTIVITIES_DIR = "raw_activities"
+SYNC_STATE_FILE = f"{RAW_ACTIVITIES_DIR}/sync_state.json"
 
-print("Open the following URL in your browser to authorize the application:")
-print(auth_url)
-
-# You need to manually retrieve the authorization code from the URL after authorization
-authorization_code = input("Enter the authorization code: ")
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Requesting the access token
-payload = {
-    'client_id': config.STRAVA_CLIENT_ID,
-    'client_secret': config.STRAVA_CLIENT_SECRET,
-    'code': authorization_code,
-    'grant_type': 'authorization_code'
-}
+def authorize():
 
-response = requests.post('https://www.strava.com/api/v3/oauth/token', data=payload, verify=False)
-tokens = response.json()
+    # https://www.strava.com/settings/api
+    if len(config.STRAVA_CLIENT_ID) == 0 or len(config.STRAVA_CLIENT_SECRET) == 0:
+        print("(!) Strava client ID or Strava client secret is missing")
+        sys.exit(1)
 
-print(tokens)
+    # Authorization URL
+    auth_url = (
+        f'https://www.strava.com/oauth/authorize?client_id={config.STRAVA_CLIENT_ID}&'
+        'redirect_uri=http://127.0.0.1&response_type=code&scope=activity:read_all&approval_prompt=auto'
+    )
 
-access_token = tokens['access_token']
-refresh_token = tokens['refresh_token']
+    print("Open the following URL in your browser to authorize the application:")
+    print(auth_url)
 
-print(f"Access Token = {access_token}")
-print(f"Refresh Token = {refresh_token}")
+    # You need to manually retrieve the authorization code from the URL after authorization
+    authorization_code = input("Enter the authorization code: ")
 
-# Function to refresh the access token
-def refresh_access_token(client_id, client_secret, refresh_token):
+    # Requesting the access token
     payload = {
-        'client_id': client_id,
-        'client_secret': client_secret,
-        'grant_type': 'refresh_token',
-        'refresh_token': refresh_token
+        'client_id': config.STRAVA_CLIENT_ID,
+        'client_secret': config.STRAVA_CLIENT_SECRET,
+        'code': authorization_code,
+        'grant_type': 'authorization_code'
     }
-    response = requests.post('https://www.strava.com/api/v3/oauth/token', data=payload, verify=False)
+
+    response = transport.default_session().post(f'{config.STRAVA_API_URL}/oauth/token', data=payload, verify=False)
     tokens = response.json()
-    return tokens['access_token'], tokens['refresh_token']
-
-# Create directory to save raw activities
-raw_activities_dir_name = f"raw_activities"
-if not os.path.exists(raw_activities_dir_name):
-    os.makedirs(raw_activities_dir_name)
-
-# Fetching activities
-page = 1
-status = 200
-
-while status == 200 and page < 10:
-    print(f"-- Fetching page {page}")
-
-    header = {'Authorization': 'Bearer ' + access_token}
-    param = {'per_page': 200, 'page': page}
-    response = requests.get("https://www.strava.com/api/v3/athlete/activities", headers=header, params=param, verify=False)
-
-    status = response.status_code
-
-    if status == 401:  # Unauthorized, refresh the token
-        print("Access token expired, refreshing token...")
-        access_token, refresh_token = refresh_access_token(client_id, client_secret, refresh_token)
-        header = {'Authorization': 'Bearer ' + access_token}
-        response = requests.get("https://www.strava.com/api/v3/athlete/activities", headers=header, params=param, verify=False)
-        status = response.status_code
-
-    if status == 200:
-        data = response.json()
-        with open(f'{raw_activities_dir_name}/activities_page_{page}.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        page += 1
+
+    print(tokens)
+
+    access_token = tokens['access_token']
+    refresh_token = tokens['refresh_token']
+
+    print(f"Access Token = {access_token}")
+    print(f"Refresh Token = {refresh_token}")
+
+    return access_token, refresh_token
+
+def epoch_for_start_date(start_date): # "2024-09-01T14:30:00Z"
+    date_object = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return int(date_object.timestamp())
+
+def update_state(state, activities):
+    # move the high-water mark to the most recent activity
+    for a in activities:
+        if "start_date" not in a:
+            continue
+        after = epoch_for_start_date(a["start_date"])
+        if after > state["after"]:
+            state["after"] = after
+            state["last_start_date"] = a["start_date"]
+            state["last_activity_id"] = a["id"]
+
+def load_state(dir_name):
+
+    if os.path.exists(SYNC_STATE_FILE):
+        with open(SYNC_STATE_FILE, 'r') as f:
+            return json.load(f)
+
+    # no state yet, derive it from pages downloaded by a previous version of this script
+    state = {"after": 0, "last_start_date": None, "last_activity_id": None}
+
+    for n in json_utils.activities_page_numbers(dir_name):
+        with open(f"{dir_name}/activities_page_{n}.json", 'r') as f:
+            update_state(state, json.load(f))
+
+    return state
+
+def save_state(state):
+    with open(SYNC_STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=4)
+
+def sync(access_token, refresh_token):
+
+    # Create directory to save raw activities
+    if not os.path.exists(RAW_ACTIVITIES_DIR):
+        os.makedirs(RAW_ACTIVITIES_DIR)
+
+    state = load_state(RAW_ACTIVITIES_DIR)
+    print(f"-- fetching activities after {state['last_start_date']} (id {state['last_activity_id']})")
+
+    existing_pages = json_utils.activities_page_numbers(RAW_ACTIVITIES_DIR)
+    first_file_number = existing_pages[-1] + 1 if existing_pages else 1
+
+    new_activities_count = 0
+    new_state = dict(state)
+
+    def on_page(page, activities):
+        nonlocal new_activities_count
+
+        # pages arrive in any order, file numbers follow page numbers
+        with open(f'{RAW_ACTIVITIES_DIR}/activities_page_{first_file_number + page - 1}.json', 'w', encoding='utf-8') as f:
+            json.dump(activities, f, ensure_ascii=False, indent=4)
+        new_activities_count += len(activities)
+        update_state(new_state, activities)
+
+    success = strava_fetcher.fetch_pages(access_token, refresh_token, state["after"], on_page)
+
+    # the high-water mark only moves once all pages after it were saved,
+    # so an interrupted sync restarts from the same point
+    if success:
+        save_state(new_state)
+        print(f"Activities fetched successfully: {new_activities_count} new activities.")
     else:
-        print(f"Error: received status code {status}")
+        print(f"Error: some pages could not be fetched, {new_activities_count} activities saved, run again to resume.")
+
+if __name__ == "__main__":
 
-print("Activities fetched successfully.")
+    if config.HTTP_MODE == "replay":
+        access_token, refresh_token = "replay", "replay" # not checked by replay_server.py
+    else:
+        access_token, refresh_token = authorize()
+    sync(access_token, refresh_token)
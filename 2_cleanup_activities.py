@@ -1,6 +1,9 @@
+import argparse
 import json
 import os
 
+import json_utils
+
 def cleanup_activity(a):
 
     keep_keys = ["name", "distance", "elapsed_time", "total_elevation_gain", "id", "start_date_local"]
@@ -19,28 +22,43 @@ def cleanup_activity(a):
 
     return d    
 
-clean_activities = []
+def clean_activities(dir_name):
+    # yields clean activities one raw page at a time, so that memory doesn't grow with the archive
 
-for i in range(1, 10):
-    print(i)
+    seen_ids = set()
 
-    p = f"raw_activities/activities_page_{i}.json"
+    for i in json_utils.activities_page_numbers(dir_name):
+        print(i)
 
-    if not os.path.exists(p):
-        break
+        p = f"{dir_name}/activities_page_{i}.json"
 
-    with open(p, 'r') as f:
-    
-        activities = json.load(f)
+        with open(p, 'r') as f:
+            activities = json.load(f)
 
-        ca = [cleanup_activity(a) for a in activities]
+        for a in activities:
+            # an interrupted sync may have saved the same activities twice
+            if a["id"] in seen_ids:
+                continue
+            seen_ids.add(a["id"])
+            yield cleanup_activity(a)
 
-        clean_activities.extend(ca)
+if __name__ == "__main__":
 
-with open("activities_clean.json", 'w', encoding='utf-8') as f:
-    count = len(clean_activities)
-    print("**", count)
-    print(f"-- writing {count} clean activities")
-    json.dump(clean_activities, f, ensure_ascii=False, indent=4)
+    parser = argparse.ArgumentParser(description="2_cleanup_activities.py options")
+    parser.add_argument('-u', '--uncompressed', action='store_true', help="Write uncompressed JSON Lines")
+    args = parser.parse_args()
+
+    # one compact JSON activity per line, gzipped
+    path = json_utils.ACTIVITIES_CLEAN_JSONL
+    if args.uncompressed:
+        path = path.removesuffix(".gz")
 
-    
+    count = json_utils.dump_jsonl(clean_activities("raw_activities"), path)
+
+    # the other variant would be stale
+    other = json_utils.ACTIVITIES_CLEAN_JSONL.removesuffix(".gz") if path.endswith(".gz") else json_utils.ACTIVITIES_CLEAN_JSONL
+    if os.path.exists(other):
+        os.remove(other)
+        print(f"-- removed {other}")
+    print("**", count)
+    print(f"-- wrote {count} clean activities")
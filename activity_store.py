@@ -0,0 +1,38 @@
+import json_utils
+
+# In-memory index of the clean activities, built once at load time.
+#
+# by_id:   activity id -> activity
+# by_page: joined_aids -> [activity, ...], sorted by start date
+
+class ActivityStore:
+
+    def __init__(self, activities, activity_ids=None):
+
+        self.by_id = {}
+        self.by_page = {}
+
+        for a in activities:
+            self.by_id[a["id"]] = a
+
+        for aids in activity_ids or []:
+            joined_aids = '_'.join([str(aid) for aid in aids])
+            self.by_page[joined_aids] = self.activities_for_aids(aids)
+
+    @classmethod
+    def load(cls, activity_ids):
+        # the archive is streamed, only the activities of the book are kept in memory
+        wanted_ids = {aid for aids in activity_ids for aid in aids if type(aid) != str}
+        activities = (a for a in json_utils.iter_activities() if a["id"] in wanted_ids)
+        return cls(activities, activity_ids)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def activities_for_aids(self, aids):
+        activities = [self.by_id[aid] for aid in aids if aid in self.by_id]
+        activities.sort(key=lambda a:a["start_date_local"])
+        return activities
+
+    def activities_for_page(self, joined_aids):
+        return self.by_page.get(joined_aids, [])
@@ -0,0 +1,71 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Startup time of the book.py commands that don't build anything.
+#
+#     python3 bench_startup.py
+#
+# Each command runs RUNS times, and fails the benchmark when its median exceeds the budget.
+# The slowest imports of a command over budget are listed, see `python3 -X importtime`.
+
+BUDGET_MS = 100
+RUNS = 10
+
+COMMANDS = [
+    ["--help"],
+    ["open", "--help"],
+    ["open", "-p", "99999"], # no such page, nothing is opened
+]
+
+def run_ms(args):
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "book.py"] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - t) * 1000
+
+def run_ms_python():
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - t) * 1000
+
+def slowest_imports(args, count=5):
+
+    p = subprocess.run([sys.executable, "-X", "importtime", "book.py"] + args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    imports = [] # (cumulative us, module)
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if not module.startswith("  "): # top level imports only
+            imports.append((int(cumulative), module.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description="bench_startup.py options")
+    parser.add_argument('-b', '--budget', type=float, default=BUDGET_MS, help="Budget in ms")
+    parser.add_argument('-n', '--runs', type=int, default=RUNS, help="Runs per command")
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_ms_python() for _ in range(args.runs))
+    print(f"-- python3 -c pass: {baseline:.0f} ms")
+
+    over = 0
+
+    for command in COMMANDS:
+        median = statistics.median(run_ms(command) for _ in range(args.runs))
+        status = "ok" if median <= args.budget else "over budget"
+        print(f"-- book.py {' '.join(command)}: {median:.0f} ms, {status}")
+
+        if median > args.budget:
+            over += 1
+            for us, module in slowest_imports(command):
+                print(f"     {us / 1000:6.1f} ms  {module}")
+
+    sys.exit(1 if over else 0)
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,9 @@ import json
 from typing import Dict, List
 import logging
 import os
-
-from PyPDF2 import PdfWriter, PdfReader
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import mm, cm
+import sys
+import subprocess
+import time
 
 # https://pdf-to-book.bookfactory.ch/fr
 
@@ -15,34 +14,16 @@ from reportlab.lib.units import mm, cm
 
 import argparse
 
-from multiprocessing import Pool
-
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase import pdfmetrics
-import polyline
-
 import json_utils
 import config
-import geocoding
-
-from reportlab.lib import colors
+import tracing
 
-import index_creator
-import map_maker
-import page_creator
-
-pdfmetrics.registerFont(TTFont('Helvetica', '/System/Library/Fonts/Helvetica.ttc'))
-pdfmetrics.registerFont(TTFont('Times',     '/System/Library/Fonts/Times.ttc'))
-
-from collections import namedtuple
-Tag = namedtuple('Tag', ['text', 'color'])
+# Modules that pull reportlab, PyPDF2, numpy, PIL or requests are imported by the functions that use them,
+# so that `open`, `-p` and `-d` start fast, see bench_startup.py.
 
 # TODO: cover: photos Dérupe 4 saisons | 1h
 
 # Constants
-ACTIVITIES_CLEAN_FILE = "activities_clean.json"
 ACTIVITIES_IDS_FILE = "activities_ids.json"
 ACTIVITIES_IDS_FILE_TEST = "activities_ids_test.json"
 #PAGES_DIR = "pages"
@@ -52,11 +33,12 @@ INDEX_PDF = "index.pdf"
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def merge_activities(activities):
+def merge_activities(activities, geometries=None):
+    import polyline_decoder
     
-    activities.sort(key=lambda a:a["start_date_local"])
+    activities = sorted(activities, key=lambda a:a["start_date_local"])
 
-    d = activities[0]
+    d = dict(activities[0]) # activities are shared with the store
     
     for a in activities[1:]:
         d["name"] += " / " + a["name"]
@@ -64,22 +46,17 @@ def merge_activities(activities):
         d["elapsed_time"] += a["elapsed_time"]
         d["total_elevation_gain"] += a["total_elevation_gain"]
         
-    coords = []
-    elevations_lengths = []
-
+    # first and last points from the geometry cache, the polylines are not decoded
+    geometries = geometries or {}
+    points = []
     for a in activities:
+        g = geometries.get(a["id"])
+        points.append((g.coords[0], g.coords[-1], len(g)) if g is not None and len(g) else None)
     
-        p = a["polyline"]
-        c = polyline.decode(p)
-        coords.extend(c)
-        elevations_lengths.append(len(c))
-
-        #print("--> ", a["id"])
-        #print("--> ", a["name"])
-        #print("--> ", len(c))
+    polyline, elevations_lengths = polyline_decoder.concat([a["polyline"] for a in activities], points)
     
-    if len(coords) > 0:
-        d["polyline"] = polyline.encode(coords)
+    if len(polyline) > 0:
+        d["polyline"] = polyline
     
     #activities.sort(key=lambda a:a["id"])
     ids = [str(a["id"]) for a in activities]
@@ -89,10 +66,13 @@ def merge_activities(activities):
         
     return d
 
-def prepare_files_structure(activities, activity_ids) -> None:
+def prepare_files_structure(store, activity_ids) -> None:
+    import geometry
 
     #print("----------------------------------------------------->", activity_ids)
 
+    geometries = geometry.build_many(store.by_id.values())
+
     for aids in activity_ids:
     
         #print("*********** aids:", aids)
@@ -107,7 +87,7 @@ def prepare_files_structure(activities, activity_ids) -> None:
 
         #print("--- dir_path:", dir_path)
         
-        matched_activities = [d for d in activities if d["id"] in aids]
+        matched_activities = store.activities_for_page(joined_aids)
         
         if not matched_activities or len(matched_activities) == 0:
             continue # eg. full page
@@ -124,11 +104,7 @@ def prepare_files_structure(activities, activity_ids) -> None:
     
         activity_file = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}_processed.json"
         if not os.path.exists(activity_file):
-            a = merge_activities(matched_activities)
-            
-            place_name = geocoding.fetch_geo(aids)
-            if place_name:
-                a["place_name"] = place_name
+            a = merge_activities(matched_activities, geometries) # place_name is added by prefetch.py
             
             json_utils.dump(a, str(activity_file))
             logging.info(f"Wrote activity {joined_aids} {names_string}")
@@ -150,8 +126,8 @@ def prepare_files_structure(activities, activity_ids) -> None:
         #    meta.pop("Bisses")
         #    json_utils.dump_meta(meta, aids)
 
-def create_pdf_pages(activity_ids, use_cache=False, index_only=False, use_parallelism=True):
-        
+def page_numbers(activity_ids):
+    
     page_for_aids = {}
         
     for i,aids in enumerate(activity_ids):
@@ -160,259 +136,422 @@ def create_pdf_pages(activity_ids, use_cache=False, index_only=False, use_parall
         joined_aids = str('_'.join(aids_str))
         
         page_for_aids[joined_aids] = i+1 # starts at page 1
+    
+    return page_for_aids
+
+def stale_pages(activity_ids, force=False):
+    import build_manifest
+    import page_creator
+    
+    # only render pages whose inputs changed since the last build
+    manifest = build_manifest.load()
+    stale_ids, fingerprints = build_manifest.stale_pages(activity_ids, manifest, page_creator.RENDERER_VERSION)
+    
+    if force:
+        stale_ids = activity_ids
+    
+    logging.info(f"Rendering {len(stale_ids)} of {len(activity_ids)} pages")
+    
+    return manifest, stale_ids, fingerprints
+
+def save_rendered_pages(manifest, rendered_ids, fingerprints, page_for_aids):
+    import build_manifest
+    import page_creator
+    
+    for aids in rendered_ids:
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        if os.path.exists(f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf"):
+            manifest["pages"][joined_aids] = fingerprints[joined_aids]
+            manifest["rendered"][joined_aids] = [page_creator.RENDERER_VERSION, build_manifest.drawn_number(aids, page_for_aids[joined_aids])]
+    
+    build_manifest.save(manifest)
+
+def create_pdf_pages(activity_ids, use_cache=False, index_only=False, use_parallelism=True, force=False):
+    import build_manifest
+    import page_creator
+    import photo_cache
+    import render_pool
         
-    if not use_cache and not index_only:
+    page_for_aids = page_numbers(activity_ids)
         
-        if use_parallelism:
-            with Pool() as pool:
-                results = pool.map(page_creator.create_page, activity_ids)
+    if not index_only:
+        
+        if use_cache:
+            # existing pages are kept, unless drawn by another renderer or for another page number,
+            # only the rendered pages are fingerprinted
+            manifest = build_manifest.load()
+            stale_ids = build_manifest.outdated_pages(activity_ids, manifest, page_creator.RENDERER_VERSION)
+            fingerprints = page_fingerprints(activity_ids, manifest, stale_ids)
+            logging.info(f"Rendering {len(stale_ids)} of {len(activity_ids)} pages, keeping the others")
         else:
-            for aids in activity_ids:
-                page_creator.create_page(aids)            
+            manifest, stale_ids, fingerprints = stale_pages(activity_ids, force)
+        
+        # photos resampled to their placed size, before the pages that draw them
+        photos = [(p, width, height) for aids in stale_ids for p, x, y, width, height in page_creator.page_photo_placements(aids)]
+        photo_cache.preprocess(photos, use_parallelism)
+        
+        # page numbers are drawn while rendering
+        pages = [(aids, page_for_aids['_'.join([str(aid) for aid in aids])]) for aids in stale_ids]
+        
+        render_pool.starmap(page_creator.create_page, pages, use_parallelism)
+        
+        save_rendered_pages(manifest, stale_ids, fingerprints, page_for_aids)
         
     return page_for_aids
 
-def add_tag(c, tag, top_right=False):
-
-    if not tag:
-        return
+def save_page_numbers(page_for_ids):
+    import catalog
     
-    c.saveState()
-
-    y = 715
-    w = 60
-    h = 26
-
-    if top_right:
-        x = 500
-        rotate_angle = -30
-    else:
-        x = 15
-        rotate_angle = 30    
+    json_utils.dump(page_for_ids, "page_for_ids.json")
+    if catalog.enabled():
+        catalog.save_page_numbers(catalog.connect(), page_for_ids)
 
-    # Translate and rotate for the tag
-    c.translate(x + w/2, y + h/2)  # Move the origin to the center of the tag
-    c.rotate(rotate_angle)  # Rotate 30 degrees counterclockwise
+def add_page(book, aids, number):
+    # returns the number of pages added
+    import page_decorations
     
-    # Move back the origin for drawing the rectangle
-    c.translate(-w / 2, -h / 2)
+    joined_aids = '_'.join([str(aid) for aid in aids])
+    
+    page_path = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf"
+    if not os.path.exists(page_path):
+        # an empty page with its number, so that the next pages and the index keep theirs
+        logging.warning(f"Missing page_path {page_path}, adding empty page {number}")
+        page_path = "missing.pdf"
+        page_decorations.create_empty_pages(page_path, number, 1)
+    
+    return book.add_pdf(page_path)
 
-    # Draw the tag - a rounded rectangle
-    c.setFillColor(tag.color)
-    corner_radius = 10
-    c.roundRect(0, 0, w, h, corner_radius, fill=1)
+def add_index_and_padding(book, page_number, with_index=True):
+    # page_number: pages already in the book, returns the number of pages of the book
+    import page_decorations
     
-    # Set the font and size for the label
-    c.setFont("Helvetica-Bold", 14) # macOS
-    c.setFillColor(colors.white)
+    if with_index and os.path.exists(INDEX_PDF):
+        page_number += book.add_pdf(INDEX_PDF)
     
-    # Label the tag with the provided text
-    c.drawCentredString(w / 2, h / 2 - 4, tag.text)
+    # make sure number of pages is a multiple of 4
     
-    # Restore the canvas state
-    c.restoreState()
-
-def draw_cut_marks(c, page_width, page_height, bleed):
-
-    t = 0.15 * cm
-
-    c.saveState()
-
-    c.setLineWidth(0.5)
-
-    c.setStrokeColorRGB(1, 0, 0)  # Set the color for cut marks
+    PAGES_MULTIPLE = 4
     
-    c.translate(-bleed, -bleed)
+    filename = "empty.pdf"
+    count = PAGES_MULTIPLE - (page_number % PAGES_MULTIPLE)
+    page_decorations.create_empty_pages(filename, page_number + 1, count)
+    print(f"-- add {count} empty pages")
+    page_number += book.add_pdf(filename)
     
-    # bottom left
-    c.line(0, bleed, t, bleed) # -
-    c.line(bleed, 0, bleed, t) # |
-
-    # bottom right
-    c.line(page_width, bleed, page_width - t, bleed) # -
-    c.line(page_width - bleed, 0, page_width - bleed, t) # |
-
-    # top left
-    c.line(0, page_height - bleed, t, page_height - bleed) # -
-    c.line(bleed, page_height, bleed, page_height - t) # |
+    return page_number
 
-    # top right
-    c.line(page_width - t, page_height - bleed, page_width, page_height - bleed) # -
-    c.line(page_width - bleed, page_height, page_width - bleed, page_height - t) # |
+def report_book(book, page_number):
     
-    c.restoreState()
+    print(f"-- {OUTPUT_FILE}: {os.path.getsize(OUTPUT_FILE) / 1024:.0f} KB out of {book.bytes_read / 1024:.0f} KB of pages, {book.duplicates} duplicate objects merged")
 
-def add_page_number_and_tags(page, number, squared, tags):
+    logging.info(f"Successfully created {OUTPUT_FILE} with {page_number} numbered pages.")
 
-    packet = BytesIO()
+@tracing.traced("assemble", cat="stage")
+def assemble_pages(activity_ids: List[List[int]], index_only=False) -> None:
+    import pdf_stream
+    
+    print("-- index_only", index_only)
+    
+    # pages are already numbered and tagged, see page_decorations.py
+    # and written one at a time, see pdf_stream.py
+    
+    with pdf_stream.BookWriter(OUTPUT_FILE) as book:
+    
+        page_number = 0
+        if not index_only:
+            for i, aids in enumerate(activity_ids):
+                page_number += add_page(book, aids, i+1)
+            
+        page_number = add_index_and_padding(book, page_number)
     
-    bleed = 3 * mm  # Bleed amount (3 mm) ("fond perdu")
-    (w,h) = config.STANDARD_PORTRAIT_BLEED
-    c = canvas.Canvas(packet, pagesize=(w, h))
+    report_book(book, page_number)
 
-    #c.bookmarkPage(str(number))  # Create a named destination
+@tracing.traced("build", cat="stage")
+def build(activity_ids, force=False):
+    """
+    Same as prefetch, create_pdf_pages, the index and assemble_pages, with each task run as soon as
+    its dependencies are done (see scheduler.py). Pages are added to the book in order, as they are rendered.
+    """
+    import geocode_cache
+    import index_creator
+    import page_creator
+    import pdf_stream
+    import photo_cache
+    import prefetch
+    import scheduler
+    import transport
+    
+    page_for_aids = page_numbers(activity_ids)
+    save_page_numbers(page_for_aids)
+    
+    manifest, stale_ids, _ = stale_pages(activity_ids, force)
+    stale = {'_'.join([str(aid) for aid in aids]) for aids in stale_ids}
+    
+    fetches = prefetch.missing_tasks(activity_ids)
+    prefetch.check_api_keys(fetches)
+    fetches_for_page = prefetch.dependencies(activity_ids, fetches)
+    
+    # fetches change the inputs of their pages, which are rendered once they are done
+    waiting = {joined_aids for joined_aids, deps in fetches_for_page.items() if deps} - stale
+    if waiting:
+        logging.info(f"Rendering {len(waiting)} more pages after their fetches")
+        stale |= waiting
+        stale_ids = [aids for aids in activity_ids if '_'.join([str(aid) for aid in aids]) in stale]
+    session = transport.new_session(config.PREFETCH_WORKERS)
+    
+    s = scheduler.Scheduler()
+    
+    # place names, maps and elevations
+    fetch_keys = [s.add(f"fetch {kind} {aid if aid else aids}", "io", prefetch.run_task, session, kind, aids, aid) for kind, aids, aid in fetches]
+    
+    # photos resampled to their placed size
+    placements = {} # joined_aids -> [(path, width, height), ...]
+    for aids in stale_ids:
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        placements[joined_aids] = [(p, width, height) for p, x, y, width, height in page_creator.page_photo_placements(aids)]
+    missing = set(photo_cache.missing_derivatives([p for photos in placements.values() for p in photos]))
+    photo_keys = {p: s.add(f"photo {p}", "cpu", photo_cache.make_derivative, *p) for p in sorted(missing)}
+    
+    # index, from _meta_.json files only
+    s.add("index", "cpu", index_creator.generate_pdf_index, index_creator.create_index(activity_ids, page_for_aids), INDEX_PDF, len(activity_ids)+1)
+    
+    with pdf_stream.BookWriter(OUTPUT_FILE) as book:
+        
+        previous = None
+        add_keys = []
+        
+        for aids in activity_ids:
+            joined_aids = '_'.join([str(aid) for aid in aids])
+            
+            render = None
+            if joined_aids in stale:
+                deps = [fetch_keys[i] for i in fetches_for_page[joined_aids]] + [photo_keys[p] for p in placements[joined_aids] if p in photo_keys]
+                render = s.add(f"render {joined_aids}", "cpu", page_creator.create_page, aids, page_for_aids[joined_aids], deps=deps)
+            
+            # in order, as soon as the page and the previous ones are ready
+            previous = s.add(f"add {joined_aids}", "main", add_page, book, aids, page_for_aids[joined_aids], deps=[render, previous])
+            add_keys.append(previous)
+        
+        def finish():
+            # pages actually added, a failed add has no result
+            page_number = sum(s.results.get(k, 0) for k in add_keys)
+            # index.pdf would be the one of a previous build
+            if "index" in s.failed:
+                print(f"** {INDEX_PDF} could not be generated, the book has no index")
+            return add_index_and_padding(book, page_number, with_index="index" not in s.failed)
+        
+        s.add("finish", "main", finish, deps=["index", previous])
+        
+        s.run()
+    
+    geocode_cache.get_cache().save()
+    
+    failed_fetches = [k for k in fetch_keys if k in s.failed]
+    if failed_fetches:
+        print(f"** {len(failed_fetches)} of {len(fetch_keys)} resources failed, run again to resume")
+    
+    # fingerprints of the inputs the pages were rendered with, fetched files included
+    rendered_ids = [aids for aids in stale_ids if f"render {'_'.join([str(aid) for aid in aids])}" not in s.failed]
+    fingerprints = page_fingerprints(activity_ids, manifest, rendered_ids)
+    
+    save_rendered_pages(manifest, rendered_ids, fingerprints, page_for_aids)
+    
+    report_book(book, s.results.get("finish", 0))
 
-    c.setLineWidth(0.5)
-    c.translate(bleed, bleed)
+def page_fingerprints(activity_ids, manifest=None, selected_ids=None):
+    import build_manifest
+    import page_creator
+    manifest = manifest or build_manifest.load()
+    return build_manifest.page_fingerprints(activity_ids, manifest, page_creator.RENDERER_VERSION, selected_ids)
 
-    c.setFont("Helvetica", 10)
+def wait_for_changes(activity_ids, use_test_data=False):
+    # returns once pages or the activity ids file changed
+    
+    path = activity_ids_file(use_test_data)
     
-    is_odd_page = number % 2 == 0
+    def state():
+        return os.stat(path).st_mtime_ns, page_fingerprints(activity_ids)
     
-    if is_odd_page == 0:
-        x_position = w - 60
-    else:
-        x_position = 40
+    initial_state = state()
     
-    y_position = 20
+    print(f"-- watching {config.PAGES_DIR}/ and {path} for changes, ctrl-c to stop")
+    
+    while state() == initial_state:
+        time.sleep(config.WATCH_INTERVAL)
 
-    if squared:
-        c.setFillColor(colors.white)
-        c.rect(x_position - 10, y_position - 5, 20, 15, stroke=1, fill=1)
-    c.setFillColor(colors.black)
-    c.drawCentredString(x_position, y_position, str(number))
+def activity_ids_file(use_test_data=False):
+    return ACTIVITIES_IDS_FILE_TEST if use_test_data else ACTIVITIES_IDS_FILE
 
-    if tags and len(tags) >= 1:
-        add_tag(c, tags[0], top_right= not is_odd_page)
-    if tags and len(tags) == 2:
-        add_tag(c, tags[1], top_right= is_odd_page) 
+def load_activity_ids(use_test_data=False):
+    return json_utils.load(activity_ids_file(use_test_data))
 
-    draw_cut_marks(c, w, h, bleed)
+@tracing.traced("prepare", cat="stage")
+def prepare(activity_ids):
+    import activity_store
     
-    c.save()
-    packet.seek(0)
-    new_pdf = PdfReader(packet)
-    page.merge_page(new_pdf.pages[0])
-    return page
-
-def create_empty_page(empty_page_path):
+    store = activity_store.ActivityStore.load(activity_ids)
+    
+    prepare_files_structure(store, activity_ids)
 
-    c = canvas.Canvas(empty_page_path, pagesize=config.STANDARD_PORTRAIT_BLEED)
-    c.showPage()
-    c.save()
+@tracing.traced("render pages", cat="stage")
+def render(activity_ids, use_cache=False, index_only=False, use_parallelism=True, force=False):
+    import index_creator
     
-def assemble_pages(activity_ids: List[List[int]], index_only=False) -> None:
-    pdf_writer = PdfWriter()
-    page_number = 0
+    page_for_ids = create_pdf_pages(activity_ids, use_cache = use_cache, index_only = index_only, use_parallelism=use_parallelism, force=force)
     
-    print("-- index_only", index_only)
+    save_page_numbers(page_for_ids)
     
-    if not index_only:
+    index_entries = index_creator.create_index(activity_ids, page_for_ids)
+    # with -i, the book is the index alone
+    index_creator.generate_pdf_index(index_entries, INDEX_PDF, first_page_number=1 if index_only else len(activity_ids)+1)
 
-        for aids in activity_ids:
-            aids_str = [str(aid) for aid in aids]
-            joined_aids = str('_'.join(aids_str))
+def sync():
     
-            page_path = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf"
-            if not os.path.exists(page_path):
-                logging.warning(f"Missing page_path {page_path}")
-                continue
-            
-            # read meta, use proper tag
-            meta = json_utils.load_meta_for_aids(aids)
-            tags = []
+    # both scripts only run as __main__
+    for script in ["1_download_activities.py", "2_cleanup_activities.py"]:
+        subprocess.run([sys.executable, script], check=True)
 
-            if meta:
-            
-                if "Course" in meta and meta["Course"] == True:
-                    tags.append(Tag(text="Course", color=colors.red))
-                if "Trail" in meta and meta["Trail"] == True:
-                    tags.append(Tag(text="Trail", color=colors.green))
-                
-            pdf_reader = PdfReader(str(page_path))
-            page = pdf_reader.pages[0]
-            page_number += 1
-            
-            if type(aids[0]) == str:
-                pdf_writer.add_page(page)
-            else:
-                numbered_page = add_page_number_and_tags(page, page_number, squared=True, tags=tags)
-                pdf_writer.add_page(numbered_page)
-        
-    if os.path.exists(INDEX_PDF):
-        index_reader = PdfReader(INDEX_PDF)
-        for page in index_reader.pages:
-            page_number += 1
-            numbered_page = add_page_number_and_tags(page, page_number, squared=False, tags=None)
-            pdf_writer.add_page(numbered_page)
+def open_directory(directory):
+    os.system(f"open {config.PAGES_DIR}/{directory}/_meta_.json")
+
+def open_page(page):
     
-    # make sure number of pages is a multiple of 4
+    page_for_ids = json_utils.load("page_for_ids.json")
     
-    PAGES_MULTIPLE = 4
-    
-    filename = "empty.pdf"
-    create_empty_page(filename)
-    for i in range(PAGES_MULTIPLE - (page_number % PAGES_MULTIPLE)):
-        empty_reader = PdfReader(filename)
-        print(f"-- {i} add page")
-        for page in empty_reader.pages: # only one page
-            page_number += 1
-            numbered_page = add_page_number_and_tags(page, page_number, squared=False, tags=None)
-            pdf_writer.add_page(numbered_page)
-    
-    with open(OUTPUT_FILE, 'wb') as output_stream:
-        pdf_writer.write(output_stream)
+    if not page_for_ids:
+        print("-- no page_for_ids.json")
+        return
+        
+    for k,v in page_for_ids.items():
+        if page == v:
+            os.system(f"open {config.PAGES_DIR}/{k}/photos/")
+            return
 
-    logging.info(f"Successfully created {OUTPUT_FILE} with {page_number} numbered pages.")
+    print(f"-- no id found for page {page}")
+
+def open_book():
+    os.system(f"/usr/bin/open {OUTPUT_FILE}")
 
 def main():
-    activities = json_utils.load(ACTIVITIES_CLEAN_FILE)
-    
     parser = argparse.ArgumentParser(description="book.py options")
     parser.add_argument('-s', '--sequential', action='store_true', help="Sequential (no parallelism)")
     parser.add_argument('-t', '--use_test_data', action='store_true', help="Use a subset of activities")
     parser.add_argument('-i', '--index_only', action='store_true', help="Generate only index")
     parser.add_argument('-c', '--cache_for_pages', action='store_true', help="Don't regenerate existing pages")
+    parser.add_argument('-f', '--force', action='store_true', help="Regenerate all pages, even unchanged ones")
+    parser.add_argument('-w', '--watch', action='store_true', help="Build again when pages or the activity ids change, with the same render processes (default build only)")
     parser.add_argument('-o', '--open', action='store_true', help="Open result file")
     parser.add_argument('-p', '--page', type=int, help="Open activity for page")
     parser.add_argument('-d', '--directory', type=str, help="Open directory")
+    parser.add_argument('--trace', action='store_true', help=f"Trace stages, pages and caches in {tracing.TRACE_DIR}/trace.json")
+    parser.add_argument('--profile', action='store_true', help="Trace, and profile every process with cProfile")
+    
+    # without command, the whole book is built, as with the options above
+    # options of the commands default to those given before the command, eg. book.py -t render
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    
+    commands.add_parser("sync", help="Download new activities and clean them up")
+    
+    p = commands.add_parser("prepare", help="Create pages directories, fetch place names, maps and elevations")
+    p.add_argument('-t', '--use_test_data', action='store_true', default=argparse.SUPPRESS, help="Use a subset of activities")
+    
+    p = commands.add_parser("render", help="Render changed pages and the index")
+    p.add_argument('-t', '--use_test_data', action='store_true', default=argparse.SUPPRESS, help="Use a subset of activities")
+    p.add_argument('-s', '--sequential', action='store_true', default=argparse.SUPPRESS, help="Sequential (no parallelism)")
+    p.add_argument('-i', '--index_only', action='store_true', default=argparse.SUPPRESS, help="Render only index")
+    p.add_argument('-c', '--cache_for_pages', action='store_true', default=argparse.SUPPRESS, help="Don't regenerate existing pages")
+    p.add_argument('-f', '--force', action='store_true', default=argparse.SUPPRESS, help="Regenerate all pages, even unchanged ones")
+    
+    p = commands.add_parser("assemble", help="Assemble rendered pages into the book")
+    p.add_argument('-t', '--use_test_data', action='store_true', default=argparse.SUPPRESS, help="Use a subset of activities")
+    p.add_argument('-i', '--index_only', action='store_true', default=argparse.SUPPRESS, help="Assemble only index")
+    p.add_argument('-o', '--open', action='store_true', default=argparse.SUPPRESS, help="Open result file")
+    
+    p = commands.add_parser("open", help="Open the book, the photos of a page or a page directory")
+    p.add_argument('-p', '--page', type=int, default=argparse.SUPPRESS, help="Open activity for page")
+    p.add_argument('-d', '--directory', type=str, default=argparse.SUPPRESS, help="Open directory")
+    
     args = parser.parse_args()
     
+    if args.watch and (args.command or args.sequential or args.index_only or args.cache_for_pages):
+        parser.error("-w/--watch only works with the default build, not with -s, -i, -c or a command")
+    
     print("--", args)
     
     if args.directory:
-        os.system(f"open {config.PAGES_DIR}/{args.directory}/_meta_.json")
+        open_directory(args.directory)
         return
     
-    if args.page:
-        page_for_ids = json_utils.load("page_for_ids.json")
-        
-        if not page_for_ids:
-            print("-- no page_for_ids.json")
-            return
-            
-        for k,v in page_for_ids.items():
-            if args.page == v:
-                os.system(f"open {config.PAGES_DIR}/{k}/photos/")
-                return
+    if args.page is not None:
+        open_page(args.page)
+        return
+    
+    if args.command == "open":
+        open_book()
+        return
+    
+    if args.command == "sync":
+        sync()
+        return
+    
+    if args.trace or args.profile:
+        tracing.enable(profile=args.profile)
+    
+    try:
+        run(args)
+    finally:
+        tracing.merge()
 
-        print(f"-- no id found for page {args.page}")
+def run(args):
+    
+    activity_ids = load_activity_ids(args.use_test_data)
+    
+    if args.command == "prepare":
+        import prefetch
+        prepare(activity_ids)
+        prefetch.prefetch(activity_ids)
         return
     
-    if args.use_test_data:
-        activity_ids = json_utils.load(ACTIVITIES_IDS_FILE_TEST)
-    else:
-        activity_ids = json_utils.load(ACTIVITIES_IDS_FILE)
+    # before rendering in this process, render workers do the same, see render_pool.py
+    import render_pool
+    render_pool.register_fonts()
     
-    prepare_files_structure(activities, activity_ids)
+    if args.command == "render":
+        render(activity_ids, use_cache = args.cache_for_pages, index_only = args.index_only, use_parallelism=not args.sequential, force=args.force)
+        return
     
-    for aids in activity_ids:
-        if type(aids[0]) == str:
-            print("** fullpage:", aids)
-            continue
-        map_maker.get_map(aids)
+    if args.command == "assemble":
+        assemble_pages(activity_ids, index_only = args.index_only)
+        if args.open:
+            open_book()
+        return
     
-    page_for_ids = create_pdf_pages(activity_ids, use_cache = args.cache_for_pages, index_only = args.index_only, use_parallelism=not args.sequential)
+    prepare(activity_ids)
+    
+    # pages rendered and added to the book as soon as their place names, maps, elevations and photos are ready
+    if not (args.sequential or args.index_only or args.cache_for_pages):
+        build(activity_ids, force=args.force)
+        while args.watch:
+            wait_for_changes(activity_ids, args.use_test_data)
+            new_activity_ids = load_activity_ids(args.use_test_data)
+            if new_activity_ids != activity_ids:
+                activity_ids = new_activity_ids
+                prepare(activity_ids)
+            build(activity_ids)
+        if args.open:
+            open_book()
+        return
     
-    json_utils.dump(page_for_ids, "page_for_ids.json")
+    # place names, maps and elevations, so that rendering never waits on the network
+    import prefetch
+    prefetch.prefetch(activity_ids)
     
-    index_entries = index_creator.create_index(activity_ids, page_for_ids)
-    index_creator.generate_pdf_index(index_entries, INDEX_PDF)
+    render(activity_ids, use_cache = args.cache_for_pages, index_only = args.index_only, use_parallelism=not args.sequential, force=args.force)
 
     assemble_pages(activity_ids, index_only = args.index_only)
     
     if args.open:
-        os.system(f"/usr/bin/open {OUTPUT_FILE}")
+        open_book()
 
 if __name__ == "__main__":
     main()
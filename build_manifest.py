@@ -0,0 +1,162 @@
+import hashlib
+import os
+
+import config
+import json_utils
+import elevation
+
+# Fingerprints the inputs of every page so that only pages whose inputs changed get rendered again.
+#
+# build_manifest.json
+# {
+#     "files": {"pages/6726577929/photos/1.jpg": [size, mtime_ns, "sha1"], ...},
+#     "pages": {"6726577929": "sha1", ...},
+#     "rendered": {"6726577929": [renderer_version, page_number], ...}
+# }
+#
+# "rendered" lets book.py -c keep existing pages without hashing their inputs, as long as they carry
+# their page number and were drawn by the current renderer.
+
+MANIFEST_FILE = "build_manifest.json"
+ICONS_DIR = "icons"
+
+def load():
+    manifest = None
+    if os.path.exists(MANIFEST_FILE):
+        manifest = json_utils.load(MANIFEST_FILE)
+    if not manifest:
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest.setdefault("pages", {})
+    manifest.setdefault("rendered", {})
+    return manifest
+
+def save(manifest) -> None:
+    # drop digests of files that disappeared
+    manifest["files"] = {p: v for p, v in manifest["files"].items() if os.path.exists(p)}
+    json_utils.dump(manifest, MANIFEST_FILE)
+
+def file_digest(path, manifest):
+    # content hash, reused as long as size and mtime are unchanged
+    st = os.stat(path)
+    cached = manifest["files"].get(path)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    manifest["files"][path] = [st.st_size, st.st_mtime_ns, digest]
+    return digest
+
+def dir_files(dir_path, excluded=()):
+    paths = []
+    for root, dirs, files in os.walk(dir_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for f in sorted(files):
+            if f.startswith("."):
+                continue
+            p = os.path.join(root, f)
+            if p in excluded:
+                continue
+            paths.append(p)
+    return paths
+
+def dir_digest(dir_path, manifest, excluded=()):
+    h = hashlib.sha1()
+    for p in dir_files(dir_path, excluded):
+        h.update(os.path.relpath(p, dir_path).encode('utf-8'))
+        h.update(file_digest(p, manifest).encode('ascii'))
+    return h.hexdigest()
+
+def drawn_number(aids, number):
+    # full page photos carry no page number, see page_creator.create_fullpage()
+    return None if type(aids[0]) == str else number
+
+def page_fingerprint(aids, manifest, icons_digest, renderer_version, number=None):
+
+    # every file of the page directory is an input: processed json, _meta_.json, _layout_.json,
+    # photos and map, except for the rendered PDF itself
+
+    joined_aids = '_'.join([str(aid) for aid in aids])
+    page_dir = f"{config.PAGES_DIR}/{joined_aids}"
+    pdf_path = f"{page_dir}/{joined_aids}.pdf"
+
+    h = hashlib.sha1()
+    h.update(str(renderer_version).encode('utf-8'))
+    h.update(str(number).encode('utf-8')) # page numbers are drawn by the renderer
+    h.update(config.ELEVATION_BACKEND.encode('utf-8'))
+    h.update(f"{config.PHOTO_DPI}/{config.PHOTO_JPEG_QUALITY}".encode('utf-8'))
+    h.update(icons_digest.encode('ascii'))
+    h.update(dir_digest(page_dir, manifest, excluded=(pdf_path,)).encode('ascii'))
+
+    # offline elevations come from the DEM tiles, see dem.py
+    if config.ELEVATION_BACKEND == "dem":
+        h.update(elevation.elevations_stamp(None).encode('utf-8'))
+
+    # elevations are shared between pages, outside of the page directory
+    for aid in aids:
+        activity_path = f"{page_dir}/{aid}.json"
+        if not os.path.exists(activity_path):
+            continue
+        p = json_utils.load(activity_path).get("polyline")
+        if p and os.path.exists(elevation.elevations_path(p)):
+            h.update(file_digest(elevation.elevations_path(p), manifest).encode('ascii'))
+
+    return h.hexdigest()
+
+def outdated_pages(activity_ids, manifest, renderer_version):
+    """
+    Returns the list of aids without a PDF rendered by renderer_version with their page number, whatever their inputs.
+    """
+
+    outdated = []
+
+    for i, aids in enumerate(activity_ids):
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        pdf_path = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf"
+
+        if not os.path.exists(pdf_path) or manifest["rendered"].get(joined_aids) != [renderer_version, drawn_number(aids, i+1)]:
+            outdated.append(aids)
+
+    return outdated
+
+def page_fingerprints(activity_ids, manifest, renderer_version, selected_ids=None):
+    """
+    Returns the fingerprints of the pages of activity_ids, or only of selected_ids when given.
+    Page numbers come from the position in activity_ids.
+    """
+
+    icons_digest = dir_digest(ICONS_DIR, manifest)
+
+    selected = None if selected_ids is None else {'_'.join([str(aid) for aid in aids]) for aids in selected_ids}
+
+    fingerprints = {}
+
+    for i, aids in enumerate(activity_ids):
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        if selected is not None and joined_aids not in selected:
+            continue
+        fingerprints[joined_aids] = page_fingerprint(aids, manifest, icons_digest, renderer_version, number=drawn_number(aids, i+1))
+
+    return fingerprints
+
+def stale_pages(activity_ids, manifest, renderer_version):
+    """
+    Returns the list of aids that need to be rendered, and the fingerprints of all pages.
+    """
+
+    fingerprints = page_fingerprints(activity_ids, manifest, renderer_version)
+    stale = []
+
+    for aids in activity_ids:
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        pdf_path = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf"
+
+        if not os.path.exists(pdf_path) or manifest["pages"].get(joined_aids) != fingerprints[joined_aids]:
+            stale.append(aids)
+
+    return stale, fingerprints
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import sqlite3
+
+import config
+import json_utils
+import elevation
+
+# Optional single-file SQLite catalog of the book state:
+# activities, _meta_.json, *_processed.json, elevations and page_for_ids.json.
+#
+#     python3 catalog.py import             # directory layout -> catalog
+#     python3 catalog.py export             # catalog -> directory layout
+#     python3 catalog.py region "Bas Valais - Sud"
+#
+# When config.CATALOG_FILE is set, json_utils reads metadata and activities from the catalog
+# instead of opening one file per page. Files stay authoritative: the catalog remembers the mtime of
+# each _meta_.json and of the clean activities file it holds, and a file changed since then
+# (hand edit, new cleanup) is read and imported again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    start_date_local TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_date ON activities (start_date_local);
+
+CREATE TABLE IF NOT EXISTS pages (
+    joined_aids TEXT PRIMARY KEY,
+    page_number INTEGER,
+    region TEXT,
+    meta TEXT,
+    processed TEXT
+);
+CREATE INDEX IF NOT EXISTS pages_region ON pages (region);
+CREATE INDEX IF NOT EXISTS pages_number ON pages (page_number);
+
+CREATE TABLE IF NOT EXISTS elevations (
+    joined_aids TEXT NOT NULL,
+    activity_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (joined_aids, activity_id)
+);
+
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS elevation_profiles (
+    polyline_hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+PAGE_FOR_IDS_FILE = "page_for_ids.json"
+
+_connections = {}
+
+def connect(path=None):
+    # one connection per process, pool workers open their own
+    path = path or config.CATALOG_FILE
+    key = (os.getpid(), path)
+    if key not in _connections:
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _connections[key] = conn
+    return _connections[key]
+
+def enabled():
+    return bool(config.CATALOG_FILE) and os.path.exists(config.CATALOG_FILE)
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False)
+
+def loads(s):
+    return json.loads(s) if s is not None else None
+
+# queries
+
+def save_source(conn, path):
+    # within a transaction, path was imported as it is now
+    conn.execute("INSERT OR REPLACE INTO sources (path, mtime_ns) VALUES (?, ?)", (path, os.stat(path).st_mtime_ns))
+
+def is_current(conn, path):
+    # False when the file at path changed since it was imported, True when there is no file
+    if not os.path.exists(path):
+        return True
+    row = conn.execute("SELECT mtime_ns FROM sources WHERE path = ?", (path,)).fetchone()
+    return row is not None and row[0] == os.stat(path).st_mtime_ns
+
+def iter_activities(conn):
+    for (data,) in conn.execute("SELECT data FROM activities ORDER BY start_date_local"):
+        yield json.loads(data)
+
+def load_meta(conn, joined_aids):
+    row = conn.execute("SELECT meta FROM pages WHERE joined_aids = ?", (joined_aids,)).fetchone()
+    return loads(row[0]) if row else None
+
+def save_meta(conn, joined_aids, meta, path=None):
+    # path: the _meta_.json file meta was read from or written to
+    with conn:
+        conn.execute("INSERT INTO pages (joined_aids, region, meta) VALUES (?, ?, ?) "
+                     "ON CONFLICT (joined_aids) DO UPDATE SET region = excluded.region, meta = excluded.meta",
+                     (joined_aids, meta.get("Region"), dumps(meta)))
+        if path:
+            save_source(conn, path)
+
+def pages_in_region(conn, region):
+    rows = conn.execute("SELECT joined_aids, page_number, meta FROM pages WHERE region = ? ORDER BY page_number",
+                        (region,))
+    return [(joined_aids, page_number, loads(meta)) for joined_aids, page_number, meta in rows]
+
+def save_page_numbers(conn, page_for_ids):
+    with conn:
+        conn.execute("UPDATE pages SET page_number = NULL")
+        for joined_aids, page_number in page_for_ids.items():
+            conn.execute("INSERT INTO pages (joined_aids, page_number) VALUES (?, ?) "
+                         "ON CONFLICT (joined_aids) DO UPDATE SET page_number = excluded.page_number",
+                         (joined_aids, page_number))
+
+def page_for_ids(conn):
+    rows = conn.execute("SELECT joined_aids, page_number FROM pages WHERE page_number IS NOT NULL ORDER BY page_number")
+    return dict(rows.fetchall())
+
+# directory layout <-> catalog
+
+def _import_activities(conn):
+    # within a transaction, replaces the activities by those of the clean activities file, returns their number
+
+    path = json_utils.activities_file()
+    count = 0
+
+    conn.execute("DELETE FROM activities")
+    for a in json_utils.iter_activities(use_catalog=False):
+        conn.execute("INSERT OR REPLACE INTO activities (id, start_date_local, data) VALUES (?, ?, ?)",
+                     (a["id"], a.get("start_date_local"), dumps(a)))
+        count += 1
+    if path:
+        save_source(conn, path)
+
+    return count
+
+def import_activities(conn):
+    with conn:
+        return _import_activities(conn)
+
+def import_layout(conn, pages_dir=None):
+
+    pages_dir = pages_dir or config.PAGES_DIR
+    page_numbers = json_utils.load(PAGE_FOR_IDS_FILE) if os.path.exists(PAGE_FOR_IDS_FILE) else {}
+
+    counts = {"activities": 0, "pages": 0, "elevations": 0}
+
+    # a single transaction, the catalog is either fully updated or left untouched
+    with conn:
+
+        counts["activities"] = _import_activities(conn)
+
+        for joined_aids in sorted(os.listdir(pages_dir)):
+            page_dir = f"{pages_dir}/{joined_aids}"
+            if not os.path.isdir(page_dir):
+                continue
+
+            meta = json_utils.load(f"{page_dir}/_meta_.json") if os.path.exists(f"{page_dir}/_meta_.json") else None
+            processed_path = f"{page_dir}/{joined_aids}_processed.json"
+            processed = json_utils.load(processed_path) if os.path.exists(processed_path) else None
+            region = meta.get("Region") if meta else None
+
+            conn.execute("INSERT OR REPLACE INTO pages (joined_aids, page_number, region, meta, processed) VALUES (?, ?, ?, ?, ?)",
+                         (joined_aids, page_numbers.get(joined_aids), region,
+                          dumps(meta) if meta is not None else None,
+                          dumps(processed) if processed is not None else None))
+            if meta is not None:
+                save_source(conn, f"{page_dir}/_meta_.json")
+            counts["pages"] += 1
+
+            for f in os.listdir(page_dir):
+                if not f.endswith("_elevations.json"):
+                    continue
+                activity_id = f[:-len("_elevations.json")]
+                if not activity_id.isdigit():
+                    continue
+                elevations = json_utils.load(f"{page_dir}/{f}")
+                conn.execute("INSERT OR REPLACE INTO elevations (joined_aids, activity_id, data) VALUES (?, ?, ?)",
+                             (joined_aids, int(activity_id), dumps(elevations)))
+                counts["elevations"] += 1
+
+        # shared elevations cache, see elevation.py
+        if os.path.isdir(elevation.ELEVATIONS_CACHE_DIR):
+            for f in os.listdir(elevation.ELEVATIONS_CACHE_DIR):
+                if not f.endswith(".json"):
+                    continue
+                elevations = json_utils.load(f"{elevation.ELEVATIONS_CACHE_DIR}/{f}")
+                conn.execute("INSERT OR REPLACE INTO elevation_profiles (polyline_hash, data) VALUES (?, ?)",
+                             (f[:-len(".json")], dumps(elevations)))
+                counts["elevations"] += 1
+
+    print(f"-- imported {counts['activities']} activities, {counts['pages']} pages, {counts['elevations']} elevations")
+
+def export_layout(conn, pages_dir=None):
+
+    pages_dir = pages_dir or config.PAGES_DIR
+
+    json_utils.dump_jsonl(iter_activities(conn), json_utils.ACTIVITIES_CLEAN_JSONL)
+
+    rows = conn.execute("SELECT joined_aids, meta, processed FROM pages")
+    for joined_aids, meta, processed in rows:
+        page_dir = f"{pages_dir}/{joined_aids}"
+        os.makedirs(page_dir, exist_ok=True)
+        if meta is not None:
+            json_utils.dump(json.loads(meta), f"{page_dir}/_meta_.json")
+        if processed is not None:
+            json_utils.dump(json.loads(processed), f"{page_dir}/{joined_aids}_processed.json")
+
+        # copies of the original activities
+        for aid in joined_aids.split("_"):
+            if not aid.isdigit():
+                continue
+            row = conn.execute("SELECT data FROM activities WHERE id = ?", (int(aid),)).fetchone()
+            if row:
+                json_utils.dump(json.loads(row[0]), f"{page_dir}/{aid}.json")
+
+    rows = conn.execute("SELECT joined_aids, activity_id, data FROM elevations")
+    for joined_aids, activity_id, data in rows:
+        os.makedirs(f"{pages_dir}/{joined_aids}", exist_ok=True)
+        json_utils.dump(json.loads(data), f"{pages_dir}/{joined_aids}/{activity_id}_elevations.json")
+
+    rows = conn.execute("SELECT polyline_hash, data FROM elevation_profiles")
+    for polyline_hash, data in rows:
+        os.makedirs(elevation.ELEVATIONS_CACHE_DIR, exist_ok=True)
+        json_utils.dump(json.loads(data), f"{elevation.ELEVATIONS_CACHE_DIR}/{polyline_hash}.json")
+
+    page_numbers = page_for_ids(conn)
+    if page_numbers:
+        json_utils.dump(page_numbers, PAGE_FOR_IDS_FILE)
+
+def main():
+    parser = argparse.ArgumentParser(description="catalog.py options")
+    parser.add_argument('command', choices=["import", "export", "region"])
+    parser.add_argument('region', nargs='?', help="Region, for the region command")
+    parser.add_argument('-f', '--file', type=str, default=config.CATALOG_FILE or "catalog.sqlite", help="Catalog file")
+    args = parser.parse_args()
+
+    conn = connect(args.file)
+
+    if args.command == "import":
+        import_layout(conn)
+    elif args.command == "export":
+        export_layout(conn)
+    elif args.command == "region":
+        for joined_aids, page_number, meta in pages_in_region(conn, args.region):
+            print(f"{page_number}\t{joined_aids}\t{meta['Titre'] if meta else ''}")
+
+if __name__ == "__main__":
+    main()
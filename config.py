@@ -6,9 +6,40 @@ w, h = STANDARD_PORTRAIT
 STANDARD_PORTRAIT_BLEED = (w + 2*BLEED, h + 2*BLEED)
 
 PAGES_DIR = "pages"
+CATALOG_FILE = None # eg. "catalog.sqlite", see catalog.py
 
 STRAVA_CLIENT_ID = ""
 STRAVA_CLIENT_SECRET = ""
+STRAVA_API_URL = "https://www.strava.com/api/v3"
+STRAVA_MAX_CONCURRENT_REQUESTS = 4
+
+PREFETCH_WORKERS = 8 # concurrent requests to MapTiler and Stadia
+RENDER_WORKERS = None # render processes, None for one per CPU, see render_pool.py
+RENDER_CHUNKSIZE = 0 # pages sent to a render process at once, 0 for automatic
+WATCH_INTERVAL = 2 # seconds between checks for changed pages, with book.py --watch
+
+PHOTO_DPI = 300 # photos are resampled to this resolution at their printed size, see photo_cache.py
+PHOTO_JPEG_QUALITY = 90
+
+MAP_SIMPLIFY_TOLERANCE_PX = 0.5 # tracks on maps are simplified to this precision
+MAP_MAX_URL_LENGTH = 8000 # longer static map requests get more simplified tracks
+
+GEOCODE_CACHE_RADIUS_M = 250 # activities starting within the same cell share their place name
+GEOCODE_CACHE_MAX_ENTRIES = 20000
+
+ELEVATION_BACKEND = "stadia" # or "dem", for offline elevations from local tiles, see dem.py
+DEM_DIR = "dem"
+DEM_MAX_OPEN_TILES = 16
+
+ELEVATION_MAX_CONCURRENT_REQUESTS = 4 # concurrent requests to Stadia
+ELEVATION_TIMEOUT = 30 # seconds
 
 STADIA_API_KEY = ""
 MAPTILER_API_KEY = ""
+
+MAPTILER_API_URL = "https://api.maptiler.com"
+STADIA_API_URL = "https://api.stadiamaps.com"
+
+HTTP_MODE = "live" # or "record" / "replay", see transport.py and replay_server.py
+HTTP_CASSETTES_DIR = "http_cassettes"
+HTTP_REPLAY_URL = "http://127.0.0.1:8777"
@@ -0,0 +1,188 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+import polyline_decoder
+
+# Offline elevations, sampled from local DEM tiles in config.DEM_DIR, as an alternative to Stadia.
+# Set config.ELEVATION_BACKEND = "dem" to use it.
+#
+# Supported tiles:
+# - SRTM .hgt, eg. N46E007.hgt, 1201x1201 or 3601x3601 big-endian int16, memory-mapped
+# - GeoTIFF .tif with one tile per degree, eg. Copernicus_DSM_COG_10_N46_00_E007_00_DEM.tif,
+#   georeferenced from their tags, needs the tifffile package
+#
+# All the points of a polyline are interpolated at once (bilinear), tile by tile.
+
+HGT_VOID = -32768
+
+class Tile:
+
+    def __init__(self, data, top_lat, left_lon, dy, dx, pixel_is_area):
+        self.data = data          # 2D array, row 0 is north
+        self.top_lat = top_lat
+        self.left_lon = left_lon
+        self.dy = dy              # degrees per row
+        self.dx = dx              # degrees per column
+        self.offset = 0.5 if pixel_is_area else 0.0
+
+    def sample(self, lats, lons):
+
+        h, w = self.data.shape
+
+        rows = (self.top_lat - lats) / self.dy - self.offset
+        cols = (lons - self.left_lon) / self.dx - self.offset
+
+        r0 = np.clip(np.floor(rows).astype(np.int64), 0, h - 2)
+        c0 = np.clip(np.floor(cols).astype(np.int64), 0, w - 2)
+        fr = np.clip(rows - r0, 0, 1)
+        fc = np.clip(cols - c0, 0, 1)
+
+        # fancy indexing only reads the 4 needed pixels per point from the memory map
+        v00 = self.data[r0, c0].astype(np.float64)
+        v01 = self.data[r0, c0 + 1].astype(np.float64)
+        v10 = self.data[r0 + 1, c0].astype(np.float64)
+        v11 = self.data[r0 + 1, c0 + 1].astype(np.float64)
+
+        for v in (v00, v01, v10, v11):
+            v[v <= HGT_VOID] = np.nan
+
+        return (v00 * (1 - fr) * (1 - fc) +
+                v01 * (1 - fr) * fc +
+                v10 * fr * (1 - fc) +
+                v11 * fr * fc)
+
+_tiles = OrderedDict() # (lat, lon) -> Tile or None, least recently used first
+_tiles_lock = threading.Lock()
+
+def tile_name(lat, lon): # (46, 7) -> "N46E007"
+    ns = "N" if lat >= 0 else "S"
+    ew = "E" if lon >= 0 else "W"
+    return f"{ns}{abs(lat):02d}{ew}{abs(lon):03d}"
+
+def find_tile_path(lat, lon):
+
+    name = tile_name(lat, lon)
+
+    hgt_path = f"{config.DEM_DIR}/{name}.hgt"
+    if os.path.exists(hgt_path):
+        return hgt_path
+
+    # N46E007.tif or Copernicus_DSM_COG_10_N46_00_E007_00_DEM.tif
+    if not os.path.isdir(config.DEM_DIR):
+        return None
+    copernicus_name = f"_{name[:3]}_00_{name[3:]}_00_"
+    for f in sorted(os.listdir(config.DEM_DIR)):
+        if f == f"{name}.tif" or (copernicus_name in f and f.lower().endswith(".tif")):
+            return f"{config.DEM_DIR}/{f}"
+
+    return None
+
+def open_hgt(path, lat, lon):
+    size = int(round(math.sqrt(os.path.getsize(path) / 2)))
+    data = np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+    step = 1 / (size - 1)
+    return Tile(data, lat + 1, lon, step, step, pixel_is_area=False)
+
+def open_geotiff(path):
+
+    try:
+        import tifffile
+    except ImportError:
+        print(f"(!) tifffile is needed to read {path}: pip install tifffile")
+        return None
+
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        scale = page.tags["ModelPixelScaleTag"].value    # (dx, dy, dz)
+        tiepoint = page.tags["ModelTiepointTag"].value   # (i, j, k, x, y, z)
+        geokeys = page.tags.get("GeoKeyDirectoryTag")
+        pixel_is_area = True
+        if geokeys:
+            keys = geokeys.value
+            for i in range(4, len(keys), 4):
+                if keys[i] == 1025: # GTRasterTypeGeoKey
+                    pixel_is_area = keys[i + 3] == 1
+
+    try:
+        data = tifffile.memmap(path) # uncompressed tiles only
+    except ValueError:
+        data = tifffile.imread(path)
+
+    dx, dy = scale[0], scale[1]
+    left_lon = tiepoint[3] - tiepoint[0] * dx
+    top_lat = tiepoint[4] + tiepoint[1] * dy
+    return Tile(data, top_lat, left_lon, dy, dx, pixel_is_area)
+
+def get_tile(lat, lon):
+
+    key = (lat, lon)
+
+    with _tiles_lock:
+        if key in _tiles:
+            _tiles.move_to_end(key)
+            return _tiles[key]
+
+    path = find_tile_path(lat, lon)
+    tile = None
+    if path and path.endswith(".hgt"):
+        tile = open_hgt(path, lat, lon)
+    elif path:
+        tile = open_geotiff(path)
+
+    if not tile:
+        print(f"** missing DEM tile {tile_name(lat, lon)} in {config.DEM_DIR}")
+
+    with _tiles_lock:
+        _tiles[key] = tile
+        while len(_tiles) > config.DEM_MAX_OPEN_TILES:
+            _tiles.popitem(last=False)
+
+    return tile
+
+def sample(lats, lons):
+    """
+    Elevations in meters for arrays of coordinates, nan where unknown.
+    """
+
+    heights = np.full(len(lats), np.nan)
+
+    tile_lats = np.floor(lats).astype(np.int64)
+    tile_lons = np.floor(lons).astype(np.int64)
+    keys, inverse = np.unique(np.stack([tile_lats, tile_lons], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    for i, (lat, lon) in enumerate(keys):
+        tile = get_tile(int(lat), int(lon))
+        if not tile:
+            continue
+        mask = inverse == i
+        heights[mask] = tile.sample(lats[mask], lons[mask])
+
+    return heights
+
+def get_elevations(polyline):
+    """
+    One elevation per point of the polyline, like the Stadia API, or None if tiles are missing.
+    """
+
+    coords = polyline_decoder.decode(polyline)
+    if len(coords) == 0:
+        return None
+
+    heights = sample(coords[:, 0], coords[:, 1])
+
+    known = ~np.isnan(heights)
+    if not known.any():
+        return None
+
+    # voids: interpolate along the track
+    if not known.all():
+        indices = np.arange(len(heights))
+        heights = np.interp(indices, indices[known], heights[known])
+
+    return [int(h) for h in np.rint(heights)]
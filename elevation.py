@@ -2,10 +2,16 @@ import requests
 import urllib3
 import json
 import os
+import hashlib
+import threading
 import config
-import sys
+
+from urllib3.util.retry import Retry
 
 import polyline_decoder
+import transport
+import dem
+import tracing
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -17,58 +23,151 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 #        print(f"-- removing {filename}")
 #        os.remove(filename)
 
-def get_elevations(polyline, joined_ids, strava_id):
+# Elevation profiles are cached in ELEVATIONS_CACHE_DIR, one file per distinct polyline, named after
+# the hash of the polyline: repeated commutes and loops share the same profile.
+# Files from previous versions, pages/{joined_ids}/{strava_id}_elevations.json, are still read.
+
+ELEVATIONS_CACHE_DIR = "elevations_cache"
+
+_session = None
+_session_lock = threading.Lock()
+_semaphore = threading.BoundedSemaphore(config.ELEVATION_MAX_CONCURRENT_REQUESTS)
+_inflight_locks = {} # polyline hash -> lock, so that identical polylines are fetched once
+
+def polyline_hash(polyline):
+    return hashlib.sha1(polyline.encode('utf-8')).hexdigest()
+
+def elevations_path(polyline):
+    return f"{ELEVATIONS_CACHE_DIR}/{polyline_hash(polyline)}.json"
+
+def get_session():
+    # keep-alive connections, retried with backoff on connection errors, 429 and 5xx
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                            allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+            _session = transport.new_session(config.ELEVATION_MAX_CONCURRENT_REQUESTS, retries=retries)
+        return _session
+
+def has_elevations(polyline, joined_ids=None, strava_id=None):
+    if os.path.exists(elevations_path(polyline)):
+        return True
+    return joined_ids is not None and os.path.exists(legacy_elevations_path(joined_ids, strava_id))
+
+def get_elevations(polyline, joined_ids=None, strava_id=None, fetch=True, session=None):
     #print("-- get_elevations", strava_id)
     
-    elevations = read_elevations(joined_ids, strava_id)
+    if not polyline:
+        return None
+    
+    if config.ELEVATION_BACKEND == "dem":
+        return dem.get_elevations(polyline) # local tiles, nothing to fetch or cache
+    
+    elevations = read_elevations(polyline, joined_ids, strava_id)
     if elevations:
+        tracing.count("elevations cache hit")
         return elevations
     
-    elevations = fetch_elevations(polyline)
-    
-    if not elevations:
-        print(f"-- no elevations for strava_id {strava_id}")
+    if not fetch:
         return None
     
-    #all_zero_elevations = sum(elevations) < 1    
-    #if all_zero_elevations:
-    #    return None
+    tracing.count("elevations cache miss")
     
-    save_elevations(elevations, joined_ids, strava_id)
+    key = polyline_hash(polyline)
+    with _session_lock:
+        inflight_lock = _inflight_locks.setdefault(key, threading.Lock())
+    
+    try:
+        with inflight_lock:
+        
+            # another thread may have fetched the same polyline meanwhile
+            elevations = read_elevations(polyline)
+            if elevations:
+                return elevations
+    
+            elevations = fetch_elevations(polyline, session)
+    
+            if not elevations:
+                print(f"-- no elevations for strava_id {strava_id}")
+                return None
+    
+            #all_zero_elevations = sum(elevations) < 1    
+            #if all_zero_elevations:
+            #    return None
+    
+            save_elevations(elevations, polyline)
+    finally:
+        # later calls read the saved file, threads already waiting hold the lock object
+        with _session_lock:
+            if _inflight_locks.get(key) is inflight_lock:
+                del _inflight_locks[key]
     
     return elevations
     
-def read_elevations(joined_ids, strava_id):
+def elevations_stamp(polyline, joined_ids=None, strava_id=None):
+    # sizes and mtimes of the files the elevations of polyline are read from, to invalidate copies (see geometry.py)
+
+    if config.ELEVATION_BACKEND == "dem":
+        if not os.path.isdir(config.DEM_DIR):
+            return ""
+        return "dem " + " ".join(f"{e.name}:{e.stat().st_size}:{e.stat().st_mtime_ns}" for e in sorted(os.scandir(config.DEM_DIR), key=lambda e: e.name))
+
+    for path in [elevations_path(polyline), legacy_elevations_path(joined_ids, strava_id) if joined_ids is not None else None]:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            return f"{st.st_size}:{st.st_mtime_ns}"
+
+    return ""
+
+def legacy_elevations_path(joined_ids, strava_id):
+    return f"pages/{joined_ids}/{strava_id}_elevations.json"
+
+def read_elevations(polyline, joined_ids=None, strava_id=None):
     #print("-- read_elevations")
 
-    filename = f"pages/{joined_ids}/{strava_id}_elevations.json"
+    filename = elevations_path(polyline)
 
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    
+    if joined_ids is None:
+        return None
+    
+    filename = legacy_elevations_path(joined_ids, strava_id)
+    
     if os.path.exists(filename):
         with open(filename, 'r') as f:
             return json.load(f)
     
     return None
 
-def save_elevations(elevations, joined_ids, strava_id):
+def save_elevations(elevations, polyline):
     print("-- save_elevations")
 
-    filename = f"pages/{joined_ids}/{strava_id}_elevations.json"
+    if not os.path.exists(ELEVATIONS_CACHE_DIR):
+        os.makedirs(ELEVATIONS_CACHE_DIR, exist_ok=True)
+
+    filename = elevations_path(polyline)
     
     try:
-        with open(filename, 'w') as f:
-            json.dump(elevations, f, indent=4)
-            print(f"-- wrote: {filename}")
+        tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, 'w') as f:
+            json.dump(elevations, f)
+        os.replace(tmp_filename, filename)
+        print(f"-- wrote: {filename}")
     except Exception as e:
         print(e)
 
-def fetch_elevations(encoded_polyline):
+def fetch_elevations(encoded_polyline, session=None):
 
     # see also https://api.open-elevation.com/api/v1/lookup?locations=41.161758,-8.583933
 
-    if len(config.STADIA_API_KEY) == 0:
+    if len(config.STADIA_API_KEY) == 0 and transport.needs_api_keys():
+        # may run in a worker, let the caller go on without elevations
         print("(!) STADIA_API_KEY is missing")
-        sys.exit(1)
-    
+        return None
 
     # https://docs.stadiamaps.com/elevation/
     
@@ -78,12 +177,18 @@ def fetch_elevations(encoded_polyline):
         "shape_format":"polyline5"
     }
     
-    url = "https://api.stadiamaps.com/elevation/v1"
+    url = f"{config.STADIA_API_URL}/elevation/v1"
 
-    response = requests.post(
-        url,
-        params=query_params,
-        verify=False)    
+    try:
+        with _semaphore:
+            response = (session or get_session()).post(
+                url,
+                params=query_params,
+                verify=False,
+                timeout=config.ELEVATION_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"-- elevation request failed: {e}")
+        return None
     
     if response.status_code != 200:
         print(response.status_code)
@@ -51,75 +51,82 @@ def select_y_ticks(min_altitude, max_altitude):
     
     return ticks
 
-def smooth_altitudes(altitudes, total_distance_meters, window_size = 2):
+def smooth_altitudes(altitudes, window_size = 2):
     
-    smoothed_altitudes = [0] * len(altitudes)
+    # moving average over window_size // 2 samples on each side, fewer at the ends
+    half = window_size // 2
+    kernel = np.ones(2 * half + 1)
+    n = len(altitudes)
     
-    for i in range(len(altitudes)):
-        window_start = max(0, i - window_size // 2)
-        window_end = min(len(altitudes), i + window_size // 2 + 1)
-        
-        altitude_window = altitudes[window_start:window_end]
-        
-        smoothed_altitudes[i] = sum(altitude_window) / len(altitude_window)
-
-    return smoothed_altitudes
+    if n == 0:
+        return np.zeros(0) # eg. zero distance activity
+    
+    sums = np.convolve(altitudes, kernel)[half:half + n]
+    counts = np.convolve(np.ones(n), kernel)[half:half + n]
+    
+    return sums / counts
 
-def altitudes_from_elevations_lists(elevations_lists, distances_list, chart_width = 200):
-        
+def altitudes_from_elevations_lists(elevations_lists, distances_list, chart_width = 200, track_distances_list = None):
+    """
+    Resamples the elevations of each activity to one altitude per pixel column, over its share of the distance.
+    Returns (xs, altitudes, starts): flat arrays of pixel columns and smoothed altitudes,
+    and the index where each activity starts in them.
+    Consecutive activities share a column, where the split line is drawn.
+    track_distances_list, optional, holds the cumulative distance of each elevation sample (see geometry.py),
+    to place samples by distance rather than by index.
+    """
+    
     chart_width = int(chart_width)
     
     assert(len(elevations_lists) == len(distances_list))
-        
-    total_distance_in_meters = sum(distances_list)
     
-    cumulated_distances_parts = [sum(distances_list[0:i+1]) for i in range(len(distances_list))]
-
+    distances = np.asarray(distances_list, dtype=np.float64)
+    total_distance_in_meters = distances.sum()
+    
+    d_stops = np.cumsum(distances)
+    d_starts = np.concatenate([[0], d_stops[:-1]])
+    
+    # elevation lists are drawn between those pixels
+    x_starts = (chart_width * d_starts / total_distance_in_meters).astype(int)
+    x_stops = (chart_width * d_stops / total_distance_in_meters).astype(int)
+    x_stops = np.where(x_stops < chart_width, x_stops + 1, x_stops) # for 2 altitudes on same x
+    
+    x_els = (d_starts / total_distance_in_meters * chart_width).astype(int) # el starts at x_el
+    
+    xs = []
     altitudes = []
-    for x in range(chart_width):
-        altitudes.append([])
+    starts = []
+    count = 0
     
-    for i,el in enumerate(elevations_lists):
-        dist = distances_list[i]
-        accrued_distance = 0 if i == 0 else cumulated_distances_parts[i-1]
-
-        # elevation list with draw on these distances
-        d_start = accrued_distance
-        d_stop = accrued_distance + dist
-                
-        # elevation list with draw between those pixels
-        x_start = int(chart_width * d_start / total_distance_in_meters)
-        x_stop = int(chart_width * d_stop / total_distance_in_meters)
-
-        if x_stop < chart_width:
-            x_stop += 1 # for 2 altitudes on same x
-
-        el_altitudes = [0]*(x_stop-x_start)
-        
-        x_el = accrued_distance / total_distance_in_meters * chart_width # el starts at x_el
-        x_el = int(x_el)
-        
-        for x in range(x_stop - x_start):
-            el_index = x / (x_stop-x_start) * len(el)    
-            a = el[int(el_index)]
-            el_altitudes[x] = a
+    track_distances_list = track_distances_list or [None] * len(elevations_lists)
+    
+    for el, track_distances, x_start, x_stop, x_el in zip(elevations_lists, track_distances_list, x_starts, x_stops, x_els):
+        n = x_stop - x_start
         
-        el_altitudes = smooth_altitudes(el_altitudes, distances_list[i])
+        if track_distances is not None and len(track_distances) == len(el) and track_distances[-1] > 0:
+            # elevation at the distance of each pixel
+            pixel_distances = np.arange(n) / n * track_distances[-1]
+            samples = np.interp(pixel_distances, track_distances, el)
+        else:
+            # one elevation per pixel, the sample at the left of the pixel,
+            # picked without converting the whole list
+            el_indices = (np.arange(n) / n * len(el)).astype(int)
+            samples = np.array([el[i] for i in el_indices.tolist()], dtype=np.float64)
         
-        for i,a in enumerate(el_altitudes):
-            altitudes[x_el + i].append(a)
+        xs.append(x_el + np.arange(n))
+        altitudes.append(smooth_altitudes(samples))
+        starts.append(count)
+        count += n
     
-    return altitudes
+    return np.concatenate(xs), np.concatenate(altitudes), np.array(starts, dtype=int)
 
-def draw_elevation_chart(c, elevations_lists, distances_list, CHART_LEFT, CHART_BOTTOM, chart_width = 200, chart_height = 140):
+def draw_elevation_chart(c, elevations_lists, distances_list, CHART_LEFT, CHART_BOTTOM, chart_width = 200, chart_height = 140, track_distances_list = None):
 
     chart_width = int(chart_width)
     
     total_distance_in_meters = sum(distances_list)
 
-    altitudes = altitudes_from_elevations_lists(elevations_lists, distances_list, chart_width)
-    
-    assert(len(altitudes) == chart_width)
+    xs, altitudes, starts = altitudes_from_elevations_lists(elevations_lists, distances_list, chart_width, track_distances_list)
     
     total_distance_km = total_distance_in_meters / 1000
         
@@ -136,24 +143,17 @@ def draw_elevation_chart(c, elevations_lists, distances_list, CHART_LEFT, CHART_
     drawing.add(Line(0, 0, chart_width, 0, strokeWidth=0.5, strokeColor=colors.black))  # x-axis
     drawing.add(Line(0, 0, 0, chart_height, strokeWidth=0.5, strokeColor=colors.black))  # y-axis
 
-    all_altitudes = [item for sublist in altitudes for item in sublist]
-
-    max_altitude = max(all_altitudes)
-    min_altitude = min(all_altitudes)
+    max_altitude = float(altitudes.max())
+    min_altitude = float(altitudes.min())
     altitude_range = max_altitude - min_altitude
     if altitude_range == 0:
         altitude_range = 1
     
-    scaled_points = []
-    
     # Collect points for the PolyLine and for the filled profile
-    profile_points = []
-    for x, alts in enumerate(altitudes):
-        #print("*", x, alts)
-        for alt in alts:
-            y = y_padding + (alt - min_altitude) / altitude_range * (chart_height - 2 * y_padding)
-            scaled_points.append((x, y))
-            profile_points.append((x, y))  # Points for filling the profile
+    ys = y_padding + (altitudes - min_altitude) / altitude_range * (chart_height - 2 * y_padding)
+    scaled_points = list(zip(xs.tolist(), ys.tolist()))
+    profile_points = list(scaled_points)  # Points for filling the profile
+    y = scaled_points[-1][1]
 
     # Add the baseline points to close the polygon for the filled area
     profile_points.append((chart_width, y))
@@ -187,7 +187,7 @@ def draw_elevation_chart(c, elevations_lists, distances_list, CHART_LEFT, CHART_
         current_km += tick_interval_km
     
     # draw split for combined activities
-    x_splits = [x for x,alts in enumerate(altitudes) if len(alts) == 2]
+    x_splits = xs[starts[1:]].tolist()
     for x in x_splits:
         dashed_line = Line(x, 0, x, chart_height, strokeWidth=0.5, strokeColor=colors.black)
         dashed_line.strokeDashArray = [3, 2]  # Dash pattern: [dash length, gap length]
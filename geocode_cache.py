@@ -0,0 +1,128 @@
+import math
+import os
+import sys
+import threading
+
+import config
+import json_utils
+import tracing
+
+# Persistent cache of reverse geocoding results, keyed by grid cells of about
+# config.GEOCODE_CACHE_RADIUS_M meters around the start points, since many activities
+# start from the same trailhead or village.
+#
+# geocode_cache.json
+# {
+#     "entries": {"2578:86893": {"place_name": "Vercorin", "rules": "commune|lieu|pays/, Suisse", "used": 12}, ...},
+#     "tick": 12
+# }
+#
+# Each entry remembers the place type rules it was resolved with (see geocoding.py),
+# entries resolved with other rules are ignored and can be purged:
+#
+#     python3 geocode_cache.py purge
+
+CACHE_FILE = "geocode_cache.json"
+METERS_PER_DEGREE = 111320
+
+class GeocodeCache:
+
+    def __init__(self, path=CACHE_FILE, radius_m=None, max_entries=None):
+        self.path = path
+        self.radius_m = radius_m or config.GEOCODE_CACHE_RADIUS_M
+        self.max_entries = max_entries or config.GEOCODE_CACHE_MAX_ENTRIES
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+        data = json_utils.load(path) if os.path.exists(path) else None
+        data = data or {}
+        self.entries = data.get("entries", {})
+        self.tick = data.get("tick", 0)
+
+    def cell(self, lat, lon):
+        # cells are radius_m high, and radius_m wide at the latitude of their row
+        lat_step = self.radius_m / METERS_PER_DEGREE
+        row = math.floor(lat / lat_step)
+        row_lat = (row + 0.5) * lat_step
+        lon_step = self.radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(row_lat)), 0.01))
+        col = math.floor(lon / lon_step)
+        return f"{row}:{col}"
+
+    def get(self, lat, lon, rules):
+        """
+        Returns (found, place_name), place_name may be None for places without a name.
+        """
+        key = self.cell(lat, lon)
+        with self.lock:
+            e = self.entries.get(key)
+            if not e or e["rules"] != rules:
+                self.misses += 1
+                tracing.count("geocode cache miss")
+                return False, None
+            self.hits += 1
+            tracing.count("geocode cache hit")
+            self.tick += 1
+            e["used"] = self.tick
+            self.dirty = True
+            return True, e["place_name"]
+
+    def put(self, lat, lon, rules, place_name):
+        key = self.cell(lat, lon)
+        with self.lock:
+            self.tick += 1
+            self.entries[key] = {"place_name": place_name, "rules": rules, "used": self.tick}
+            self.dirty = True
+            self.evict()
+
+    def evict(self):
+        # least recently used entries go first
+        overflow = len(self.entries) - self.max_entries
+        if overflow <= 0:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["used"])[:overflow]:
+            del self.entries[key]
+
+    def purge_stale(self, rules):
+        with self.lock:
+            stale = [k for k, e in self.entries.items() if e["rules"] != rules]
+            for k in stale:
+                del self.entries[k]
+            if stale:
+                self.dirty = True
+            return len(stale)
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            json_utils.dump({"entries": self.entries, "tick": self.tick}, self.path)
+            self.dirty = False
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self.entries)} entries"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    # first called by several prefetch threads at once, they must share one cache
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GeocodeCache()
+    return _cache
+
+if __name__ == "__main__":
+
+    import geocoding
+
+    if len(sys.argv) == 2 and sys.argv[1] == "purge":
+        cache = get_cache()
+        count = cache.purge_stale(geocoding.rules_key())
+        cache.save()
+        print(f"-- purged {count} stale entries")
+    else:
+        print("usage: python3 geocode_cache.py purge")
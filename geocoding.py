@@ -1,27 +1,31 @@
 # https://pdf-to-book.bookfactory.ch/fr
 
-import requests
 import urllib3
 import os
 import logging
-import polyline_decoder
 import json
 import json_utils
 import config
+import geocode_cache
+import geometry
+import transport
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def fetch_geo(activity_ids):
-    
-    print("**-- activity_ids:", activity_ids)
+PREFERRED_PLACE_TYPE_NAMES = ['commune', 'lieu', 'pays']
+SUFFIX_TO_REMOVE = ", Suisse"
+
+def rules_key():
+    # results cached with other rules are ignored
+    return '|'.join(PREFERRED_PLACE_TYPE_NAMES) + "/" + SUFFIX_TO_REMOVE
+
+def start_point(activity_ids):
     
     aids_str = [str(aid) for aid in activity_ids]
     joined_aids = str('_'.join(aids_str))
     
-    lat, lon = None, None
-    
     for aid in activity_ids:
         activity_file = f"pages/{joined_aids}/{aid}.json"
 
@@ -34,12 +38,37 @@ def fetch_geo(activity_ids):
                 if not p:
                     continue
 
-                [(lat, lon)] = polyline_decoder.decode_polyline_lat_lon(p, only_first=True)
-                break
+                return geometry.load(aid, p, joined_aids).start
+    
+    return None, None
+
+def fetch_geo(activity_ids, session=None):
+    
+    print("**-- activity_ids:", activity_ids)
+    
+    lat, lon = start_point(activity_ids)
     
     if not lat or not lon:
         return None
     
+    cache = geocode_cache.get_cache()
+    
+    found, place_name = cache.get(lat, lon, rules_key())
+    if found:
+        print("--cached", place_name)
+        return place_name
+    
+    ok, place_name = reverse_geocode(lat, lon, session)
+    if ok:
+        cache.put(lat, lon, rules_key(), place_name)
+    
+    return place_name
+
+def reverse_geocode(lat, lon, session=None):
+    """
+    Returns (ok, place_name), ok is False if the request failed.
+    """
+    
     #print(lat, lon)
         
     # https://api.maptiler.com/maps/a21bea99-ab0d-49c3-9900-8640bbe2e9c7/static/auto/600x600@2x.png?path=stroke:red|fill:none|enc:_p~iF~ps|U_ulLnnqC_mqNvxq`@&key=xxx&markers=-120.2,38.5,green
@@ -52,12 +81,12 @@ def fetch_geo(activity_ids):
         #("types", ["municipality", "place"])
     ]
     
-    url = f"https://api.maptiler.com/geocoding/{lon},{lat}.json"
+    url = f"{config.MAPTILER_API_URL}/geocoding/{lon},{lat}.json"
 
     print("**", url)
     print("-- query_params:", query_params)
     
-    response = requests.get(
+    response = (session or transport.default_session()).get(
         url,
         params=query_params,
         verify=False)    
@@ -65,7 +94,7 @@ def fetch_geo(activity_ids):
     if response.status_code != 200:
         print(response.status_code)
         print(response.text)
-        return
+        return False, None
         
     d = response.json()
             
@@ -73,8 +102,6 @@ def fetch_geo(activity_ids):
 
     place_name = None
     
-    preferred_place_type_name = ['commune', 'lieu', 'pays']
-    
     for f in features:
         if place_name:
             break
@@ -86,7 +113,7 @@ def fetch_geo(activity_ids):
         
         print("-> ?", properties["place_type_name"], f)
         
-        for ptn in preferred_place_type_name:
+        for ptn in PREFERRED_PLACE_TYPE_NAMES:
             if ptn in properties["place_type_name"]:
                 place_name = f["place_name_fr"]
                 break
@@ -94,15 +121,14 @@ def fetch_geo(activity_ids):
     print("--1", place_name)
     
     if not place_name:
-        return None
+        return True, None
     
-    suffix_to_remove = ", Suisse"
-    if place_name.endswith(suffix_to_remove):
-        place_name = place_name[:-len(suffix_to_remove)]
+    if place_name.endswith(SUFFIX_TO_REMOVE):
+        place_name = place_name[:-len(SUFFIX_TO_REMOVE)]
 
     print("--2", place_name)
     
-    return place_name
+    return True, place_name
     
 if __name__ == "__main__":
     
@@ -112,6 +138,8 @@ if __name__ == "__main__":
     fetch_geo(["7472671840"])
     fetch_geo(["9062353745"])
     
+    geocode_cache.get_cache().save()
+    
     
     
 
@@ -0,0 +1,168 @@
+import os
+import threading
+
+import numpy as np
+
+import config
+import polyline_decoder
+import elevation
+import tracing
+
+# Geometry of each activity, decoded once from its polyline and kept in GEOMETRY_CACHE_DIR/{aid}.npz:
+#
+# coords      (n, 2) int32, lat / lon in 1e-5 degrees
+# distances   (n,) float32, cumulative haversine distance in meters
+# bbox        min lat, min lon, max lat, max lon, in degrees
+# elevations  (n,) float32, empty until they are known (see prefetch.py)
+# polyline    sha1 of the polyline, the file is rebuilt when the polyline changes
+# elevations_stamp  see elevation.elevations_stamp(), elevations are read again when their file changes
+#
+# Files are built for all the activities of the book at once in book.prepare_files_structure(),
+# then read by geocoding, map_maker, merge_activities() and the elevation charts.
+
+GEOMETRY_CACHE_DIR = "geometry_cache"
+EARTH_RADIUS_M = 6371008.8
+
+class Geometry:
+
+    def __init__(self, coords, distances, bbox, elevations):
+        self.coords = coords
+        self.distances = distances
+        self.bbox = bbox
+        self.elevations = elevations
+
+    def __len__(self):
+        return len(self.coords)
+
+    def lat_lon(self):
+        return self.coords / polyline_decoder.FACTOR
+
+    @property
+    def start(self):
+        if len(self.coords) == 0:
+            return None, None
+        lat, lon = self.coords[0] / polyline_decoder.FACTOR
+        return float(lat), float(lon)
+
+    @property
+    def end(self):
+        if len(self.coords) == 0:
+            return None, None
+        lat, lon = self.coords[-1] / polyline_decoder.FACTOR
+        return float(lat), float(lon)
+
+def cumulative_distances(coords):
+    # haversine, coords in 1e-5 degrees
+
+    if len(coords) == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    lat, lon = np.radians(coords[:, 0] / polyline_decoder.FACTOR), np.radians(coords[:, 1] / polyline_decoder.FACTOR)
+    dlat, dlon = np.diff(lat), np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+    return np.concatenate([[0], np.cumsum(steps)]).astype(np.float32)
+
+def from_coords(coords, elevations=None):
+
+    coords = coords.astype(np.int32)
+
+    if len(coords):
+        bbox = np.concatenate([coords.min(axis=0), coords.max(axis=0)]) / polyline_decoder.FACTOR
+    else:
+        bbox = np.zeros(4)
+
+    if elevations is None or len(elevations) != len(coords):
+        elevations = []
+
+    return Geometry(coords, cumulative_distances(coords), bbox, np.asarray(elevations, dtype=np.float32))
+
+def cache_path(aid):
+    return f"{GEOMETRY_CACHE_DIR}/{aid}.npz"
+
+def save(aid, polyline, g, joined_aids=None):
+
+    os.makedirs(GEOMETRY_CACHE_DIR, exist_ok=True)
+
+    stamp = elevation.elevations_stamp(polyline, joined_aids, aid) if len(g.elevations) else ""
+
+    tmp_path = f"{cache_path(aid)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, coords=g.coords, distances=g.distances, bbox=g.bbox, elevations=g.elevations,
+                 polyline=elevation.polyline_hash(polyline), elevation_backend=config.ELEVATION_BACKEND, elevations_stamp=stamp)
+    os.replace(tmp_path, cache_path(aid))
+
+def read(aid, polyline, joined_aids=None):
+    # cached geometry, None if missing or built for another polyline, without elevations if they changed since
+
+    path = cache_path(aid)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        if str(data["polyline"]) != elevation.polyline_hash(polyline):
+            return None
+        g = Geometry(data["coords"], data["distances"], data["bbox"], data["elevations"])
+        stamp = str(data["elevations_stamp"]) if "elevations_stamp" in data.files else None
+        if len(g.elevations) and stamp != elevation.elevations_stamp(polyline, joined_aids, aid):
+            g.elevations = np.zeros(0, dtype=np.float32)
+        if str(data["elevation_backend"]) != config.ELEVATION_BACKEND:
+            g.elevations = np.zeros(0, dtype=np.float32)
+
+    return g
+
+def load(aid, polyline, joined_aids=None):
+    """
+    Geometry of an activity, built if needed, with its elevations as soon as they are known.
+    """
+
+    g = read(aid, polyline, joined_aids)
+    changed = g is None
+    tracing.count("geometry cache miss" if changed else "geometry cache hit")
+
+    if g is None:
+        g = from_coords(polyline_decoder.decode(polyline, as_int=True))
+
+    if len(g.elevations) == 0 and len(g) > 0:
+        e = elevation.get_elevations(polyline, joined_aids, aid, fetch=False)
+        if e and len(e) == len(g):
+            g.elevations = np.asarray(e, dtype=np.float32)
+            changed = True
+
+    if changed:
+        save(aid, polyline, g, joined_aids)
+
+    return g
+
+def build_many(activities):
+    """
+    Builds the missing geometries of activities, decoding all their polylines at once.
+    Returns {aid: Geometry}.
+    """
+
+    geometries = {}
+    missing = []
+
+    for a in activities:
+        p = a.get("polyline")
+        if not p:
+            continue
+        g = read(a["id"], p)
+        if g is None:
+            missing.append(a)
+        else:
+            geometries[a["id"]] = g
+
+    tracing.count("geometry cache hit", len(geometries))
+    tracing.count("geometry cache miss", len(missing))
+
+    if missing:
+        coords, offsets = polyline_decoder.decode_many([a["polyline"] for a in missing], as_int=True)
+        for i, a in enumerate(missing):
+            g = from_coords(coords[offsets[i]:offsets[i+1]])
+            save(a["id"], a["polyline"], g)
+            geometries[a["id"]] = g
+        print(f"-- built {len(missing)} geometries")
+
+    return geometries
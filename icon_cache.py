@@ -0,0 +1,51 @@
+import os
+import re
+import sys
+
+from reportlab.graphics import renderPDF
+from svglib.svglib import svg2rlg
+
+# SVG icons are parsed once per process, and drawn once per PDF file as a Form XObject,
+# then placed by reference (doForm) wherever they appear in that file.
+
+_drawings = {} # svg path -> (drawing, bounds, mtime), unscaled, shared by all the canvases
+
+def get_drawing(svg_path):
+
+    # parsed again when the file changes, render workers live across builds (see render_pool.py)
+    mtime = os.stat(svg_path).st_mtime_ns
+
+    if svg_path not in _drawings or _drawings[svg_path][2] != mtime:
+        drawing = svg2rlg(svg_path)
+        if not drawing:
+            print(f"-- can't build drawing for {svg_path}")
+            sys.exit(1)
+        _drawings[svg_path] = (drawing, drawing.getBounds(), mtime)
+
+    return _drawings[svg_path][0]
+
+def form_name(svg_path): # "icons/summit.svg" -> "icons_summit"
+    return re.sub(r'[^A-Za-z0-9]', '_', os.path.splitext(svg_path)[0])
+
+def draw_icon(c, svg_path, x, y, x_scale, y_scale=None):
+    """
+    Same as drawing.scale(x_scale, y_scale) and renderPDF.draw(drawing, c, x, y).
+    """
+
+    if y_scale is None:
+        y_scale = x_scale
+
+    name = form_name(svg_path)
+
+    if not c.hasForm(name):
+        drawing = get_drawing(svg_path)
+        x0, y0, x1, y1 = _drawings[svg_path][1]
+        c.beginForm(name, min(0, x0), min(0, y0), max(drawing.width, x1), max(drawing.height, y1))
+        renderPDF.draw(drawing, c, 0, 0)
+        c.endForm()
+
+    c.saveState()
+    c.translate(x, y)
+    c.scale(x_scale, y_scale)
+    c.doForm(name)
+    c.restoreState()
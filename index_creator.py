@@ -1,15 +1,16 @@
 import re
 
-from svglib.svglib import svg2rlg
 
 import reportlab
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable, PageBreak, Image
-from reportlab.graphics import renderPDF
 from reportlab.lib.colors import black
 
 import config
+import icon_cache
+import page_decorations
 import json_utils
+import tracing
 
 def split_summit_and_altitude(s):
     # The regex pattern matches any text (summit name), 
@@ -62,12 +63,8 @@ class AlignedText(Flowable):
 class SVGFlowable(Flowable):
     def __init__(self, svg_path, x_scale, y_scale, x, y, framed):
         Flowable.__init__(self)
-        self.drawing = svg2rlg(svg_path)
-        if not self.drawing:
-            import sys
-            print(f"-- can't build drawing for {svg_path}")
-            sys.exit(1)
-        self.drawing.scale(x_scale, y_scale)  # Scale the drawing
+        self.svg_path = svg_path
+        self.drawing = icon_cache.get_drawing(svg_path) # parsed once, drawn by reference
         self.x_scale = x_scale
         self.y_scale = y_scale
         self.x = x
@@ -75,7 +72,7 @@ class SVGFlowable(Flowable):
         self.framed = framed
 
     def draw(self):
-        renderPDF.draw(self.drawing, self.canv, self.x, self.y)  # Adjust position as needed
+        icon_cache.draw_icon(self.canv, self.svg_path, self.x, self.y, self.x_scale, self.y_scale)  # Adjust position as needed
 
         if self.framed:
             width = self.drawing.width * self.x_scale
@@ -172,7 +169,8 @@ def create_index(activity_ids, page_for_ids):
     
     return sorted_index
 
-def generate_pdf_index(data, file_name):
+@tracing.traced("index", cat="render")
+def generate_pdf_index(data, file_name, first_page_number=1):
     
     images_for_section = {
         "Sommets"  :("icons/summit.svg",   0.02, 0.02, -20, 7, False),
@@ -240,4 +238,11 @@ def generate_pdf_index(data, file_name):
         #if cat == "Bisses":
         #    break
             
-    doc.build(elements)
+    def decorate(c, doc):
+        # numbered in the book, after the activities pages
+        c.saveState()
+        c.translate(config.BLEED, config.BLEED)
+        page_decorations.draw(c, first_page_number + doc.page - 1, squared=False, tags=None)
+        c.restoreState()
+    
+    doc.build(elements, onFirstPage=decorate, onLaterPages=decorate)
@@ -1,7 +1,12 @@
+import gzip
 import json
 import os
+import re
+import threading
 import config
 
+ACTIVITIES_CLEAN_JSONL = "activities_clean.jsonl.gz"
+ACTIVITIES_CLEAN_JSON = "activities_clean.json" # legacy, single JSON array
 
 def load(file_path):
     #print(f"-- load: {file_path}")
@@ -17,17 +22,117 @@ def load(file_path):
             print(f"** cannot load {file_path}")
             print(e)
 
+def write(data, file_path) -> None:
+    # through a temporary file, so that concurrent readers (eg. prefetch tasks) never see a partial file
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, file_path)
+
 def dump(data, file_path) -> None:
     print(f"-- save: {file_path}")
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    write(data, file_path)
 
 def dump_meta(data, aids) -> None:
     joined_aids = '_'.join([str(aid) for aid in aids])
     file_path = f"{config.PAGES_DIR}/{joined_aids}/_meta_.json"
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    write(data, file_path)
+
+    if config.CATALOG_FILE:
+        import catalog
+        if catalog.enabled():
+            catalog.save_meta(catalog.connect(), joined_aids, data, file_path)
 
 def load_meta_for_aids(aids):
     joined_aids = '_'.join([str(aid) for aid in aids])
-    return load(f"{config.PAGES_DIR}/{joined_aids}/_meta_.json")
+    file_path = f"{config.PAGES_DIR}/{joined_aids}/_meta_.json"
+
+    if config.CATALOG_FILE:
+        import catalog
+        if catalog.enabled():
+            conn = catalog.connect()
+            if catalog.is_current(conn, file_path):
+                meta = catalog.load_meta(conn, joined_aids)
+                if meta is not None:
+                    return meta
+            # edited since it was imported, the file wins
+            meta = load(file_path)
+            if meta is not None:
+                catalog.save_meta(conn, joined_aids, meta, file_path)
+            return meta
+
+    return load(file_path)
+
+def open_text(file_path, mode='rt', compressed=None):
+    # transparently (de)compresses .gz files
+    if compressed is None:
+        compressed = file_path.endswith(".gz")
+    if compressed:
+        return gzip.open(file_path, mode, encoding='utf-8')
+    return open(file_path, mode, encoding='utf-8')
+
+def iter_jsonl(file_path):
+    # yields the records of a JSON Lines file, one at a time
+
+    if not os.path.exists(file_path):
+        print(f"** missing file {file_path}")
+        return
+
+    with open_text(file_path, 'rt') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def dump_jsonl(records, file_path):
+    # writes records one per line, compact, compressed if file_path ends with .gz
+    print(f"-- save: {file_path}")
+    count = 0
+    tmp_path = f"{file_path}.tmp"
+    with open_text(tmp_path, 'wt', compressed=file_path.endswith(".gz")) as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False, separators=(',', ':')))
+            f.write("\n")
+            count += 1
+    os.replace(tmp_path, file_path)
+    return count
+
+def activities_page_numbers(dir_name):
+    # numbers of the existing activities_page_N.json files of raw activities, sorted
+    numbers = []
+    for f in os.listdir(dir_name):
+        m = re.match(r"^activities_page_(\d+)\.json$", f)
+        if m:
+            numbers.append(int(m.group(1)))
+    return sorted(numbers)
+
+def activities_file():
+    # the newest of activities_clean.jsonl.gz and activities_clean.jsonl, None if there is none
+
+    paths = [p for p in [ACTIVITIES_CLEAN_JSONL, ACTIVITIES_CLEAN_JSONL.removesuffix(".gz")] if os.path.exists(p)]
+    if len(paths) > 1:
+        print(f"** both {paths[0]} and {paths[1]} exist, reading the newest")
+
+    return max(paths, key=lambda p: os.stat(p).st_mtime_ns, default=None)
+
+def iter_activities(use_catalog=True):
+    # clean activities, read lazily from the catalog if enabled, or the JSON Lines file written by 2_cleanup_activities.py
+
+    if use_catalog and config.CATALOG_FILE:
+        import catalog
+        if catalog.enabled():
+            conn = catalog.connect()
+            path = activities_file()
+            if path and not catalog.is_current(conn, path):
+                print(f"-- {path} changed, importing it into the catalog")
+                catalog.import_activities(conn)
+            yield from catalog.iter_activities(conn)
+            return
+
+    path = activities_file()
+    if path:
+        yield from iter_jsonl(path)
+        return
+
+    activities = load(ACTIVITIES_CLEAN_JSON)
+    if activities:
+        yield from activities
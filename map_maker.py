@@ -1,10 +1,13 @@
-import requests
 import urllib3
 import os
 import sys
-import polyline_decoder
+from urllib.parse import urlencode
 import json_utils
 import config
+import transport
+import tracing
+import simplify
+import geometry
 
 import page_creator
 
@@ -17,17 +20,20 @@ def map_file_path(activity_ids):
     joined_aids = str('_'.join(aids_str))
     return f"pages/{joined_aids}/{joined_aids}_map.png"
 
-def get_map(activity_ids):    
+def get_map(activity_ids, session=None):    
     filename = map_file_path(activity_ids)
     
-    if not os.path.exists(filename):
-        fetch_map(activity_ids)
+    if os.path.exists(filename):
+        tracing.count("map cache hit")
+    else:
+        tracing.count("map cache miss")
+        fetch_map(activity_ids, session)
     
     return filename
 
-def fetch_map(activity_ids):
+def fetch_map(activity_ids, session=None):
     
-    if len(config.MAPTILER_API_KEY) == 0:
+    if len(config.MAPTILER_API_KEY) == 0 and transport.needs_api_keys():
         print("(!) MAPTILER_API_KEY is missing")
         sys.exit(1)
     
@@ -36,7 +42,7 @@ def fetch_map(activity_ids):
     aids_str = [str(aid) for aid in activity_ids]
     joined_aids = str('_'.join(aids_str))
 
-    polylines_for_map = []
+    tracks_for_map = []
     markers_for_map = []
     
     lat, lon = None, None
@@ -54,9 +60,10 @@ def fetch_map(activity_ids):
                 if not p:
                     continue
 
-                polylines_for_map.append(p)
+                g = geometry.load(aid, p, joined_aids)
+                tracks_for_map.append(g.coords)
                 
-                [(lat, lon)] = polyline_decoder.decode_polyline_lat_lon(p, only_first=True)
+                lat, lon = g.start
                 markers_for_map.append((lat, lon))
     
     if not lat or not lon:
@@ -71,18 +78,6 @@ def fetch_map(activity_ids):
     
     # https://cloud.maptiler.com/maps/editor?map=a21bea99-ab0d-49c3-9900-8640bbe2e9c7#14.86/46.3856/8.02434
     
-    query_params = [
-        ("key", config.MAPTILER_API_KEY),
-        ("attribution", "false")#,
-        #("padding", "0.05")
-    ]
-    
-    for p in polylines_for_map:
-        query_params.append(("path", f"stroke:red|fill:none|width:2|enc:{p}"))
-    
-    for lat,lon in markers_for_map:
-        query_params.append(("markers", f"{lon},{lat},green"))
-    
     custom_map_id = "a21bea99-ab0d-49c3-9900-8640bbe2e9c7"
     
     factor = 1.74 # increase for more details / resolution
@@ -90,12 +85,36 @@ def fetch_map(activity_ids):
     from reportlab.lib.units import mm, cm
     w, h = int((205*mm + 2*mm) * factor), int((182 + 1*mm) *factor) # including cut margins
     
-    url = f"https://api.maptiler.com/maps/{custom_map_id}/static/auto/{w}x{h}@2x.png"
+    url = f"{config.MAPTILER_API_URL}/maps/{custom_map_id}/static/auto/{w}x{h}@2x.png"
+    
+    # tracks are simplified to what the map can show, and further while the URL is too long
+    budget = simplify.vertex_budget(2*w, 2*h)
+    
+    while True:
+        paths, vertices = simplify.simplify_tracks(tracks_for_map, (2*w, 2*h), budget)
         
+        query_params = [
+            ("key", config.MAPTILER_API_KEY),
+            ("attribution", "false")#,
+            #("padding", "0.05")
+        ]
+        
+        for p in paths:
+            query_params.append(("path", f"stroke:red|fill:none|width:2|enc:{p}"))
+        
+        for lat,lon in markers_for_map:
+            query_params.append(("markers", f"{lon},{lat},green"))
+        
+        url_length = len(url) + 1 + len(urlencode(query_params))
+        if url_length <= config.MAP_MAX_URL_LENGTH or budget < 2:
+            break
+        budget //= 2
+    
     print("**", url)
+    print(f"-- {vertices} vertices, URL length {url_length}")
     #print("-- query_params:", query_params)
     
-    response = requests.get(
+    response = (session or transport.default_session()).get(
         url,
         params=query_params,
         verify=False)
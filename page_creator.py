@@ -4,6 +4,7 @@ import locale
 import elevation
 import os
 import elevation_chart
+import geometry
 import json
 from typing import Dict, List
 from collections import namedtuple
@@ -11,17 +12,23 @@ from collections import namedtuple
 import map_maker
 import json_utils
 import config
+import icon_cache
+import photo_cache
+import page_decorations
+import tracing
 
-from reportlab.graphics import renderPDF
 from reportlab.lib import colors
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import mm, cm
 
-from svglib.svglib import svg2rlg
 
 from collections import namedtuple
 
-locale.setlocale(locale.LC_TIME, "fr_FR.UTF-8") # TODO: config.json
+RENDERER_VERSION = 5 # bump when the page drawing code changes, to re-render all pages
+
+def init():
+    # once per process, see render_pool.py
+    locale.setlocale(locale.LC_TIME, "fr_FR.UTF-8") # TODO: config.json
 
 def convert_meters_to_kilometers(meters):
     # Convert meters to kilometers
@@ -38,36 +45,24 @@ def convert_seconds_to_hms(seconds):
     # Format the result as "HH:mm:ss"
     return f"{hours}:{minutes:02}.{remaining_seconds:02}"
 
-def draw_photos(c, page_path, meta):
+def photo_placements(page_path): # [(path, x, y, width, height), ...]
     
     PHOTOS_PATH = f"{page_path}/photos"
     if not os.path.exists(PHOTOS_PATH):
-        return
+        return []
     
     photos_count = len([f for f in os.listdir(PHOTOS_PATH) if os.path.isfile(os.path.join(PHOTOS_PATH, f)) and f.endswith(".jpg")])
 
     #print(f"Number of photos: {photos_count}")    
     
-    draw_photo_border = True
-    if "photo_border" in meta and meta["photo_border"] == False:
-        draw_photo_border = False
+    placements = []
     
     if photos_count == 1:
         p = f'{page_path}/photos/1.jpg'
         
         if os.path.exists(p):
-
-            file_size_in_mb = os.path.getsize(p) / 1024**2
-            if file_size_in_mb < 2:
-                print(f"oo> too small: {p} {file_size_in_mb:.2f} MB")
-
-
             factor = 0.1733 * 2
-            x = 15
-            y = 190
-            c.drawImage(p, x, y, 1600 * factor, 1200 * factor)
-            if draw_photo_border:
-                c.rect(x, y, 1600 * factor, 1200 * factor)
+            placements.append((p, 15, 190, 1600 * factor, 1200 * factor))
         
     if photos_count == 4:
     
@@ -78,21 +73,47 @@ def draw_photos(c, page_path, meta):
             p = f'{page_path}/photos/{i}.jpg'
             
             if os.path.exists(p):
-                
-                #file_size_in_mb = os.path.getsize(p) / 1024**2
-                #if file_size_in_mb > 2:
-                #    print(f"oo> too large: {p} {file_size_in_mb:.2f} MB")
-                
-                #with Image.open(p) as img:
-                #    width, height = img.size
-                #    if width != 1600:
-                #        print(f"ooo> {width} px: {p}")
-                
                 factor = 0.17
                 x, y = coords[i-1]
-                c.drawImage(p, x, y, 1600 * factor, 1200 * factor)
-                if draw_photo_border:
-                    c.rect(x, y, 1600 * factor, 1200 * factor)
+                placements.append((p, x, y, 1600 * factor, 1200 * factor))
+    
+    return placements
+
+def fullpage_photo_placements(page_path):
+    
+    photo_path = f"{page_path}/photo.jpg"
+    if not os.path.exists(photo_path):
+        return []
+    
+    factor = 0.2
+    return [(photo_path, -20, -5, 3024 * factor, 4032 * factor)]
+
+def page_photo_placements(aids):
+    joined_aids = '_'.join([str(aid) for aid in aids])
+    page_path = f"pages/{joined_aids}"
+    if type(aids[0]) == str:
+        return fullpage_photo_placements(page_path)
+    return photo_placements(page_path)
+
+def draw_photos(c, page_path, meta):
+    
+    placements = photo_placements(page_path)
+    
+    draw_photo_border = True
+    if "photo_border" in meta and meta["photo_border"] == False:
+        draw_photo_border = False
+    
+    if len(placements) == 1:
+        p = placements[0][0]
+        file_size_in_mb = os.path.getsize(p) / 1024**2
+        if file_size_in_mb < 2:
+            print(f"oo> too small: {p} {file_size_in_mb:.2f} MB")
+    
+    for p, x, y, width, height in placements:
+        # resampled to the placed size, see photo_cache.py
+        c.drawImage(photo_cache.make_derivative(p, width, height), x, y, width, height)
+        if draw_photo_border:
+            c.rect(x, y, width, height)
 
 def pretty_date(date_string): # "2024-09-01T14:30:00Z"
 
@@ -135,18 +156,14 @@ def create_fullpage(aids):
     page_dir    = f"pages/{joined_aids}"
     layout_path = f"{page_dir}/_layout_.json"
     pdf_path    = f"{page_dir}/{joined_aids}.pdf"
-    photo_path  = f"{page_dir}/photo.jpg"
 
     w,h = config.STANDARD_PORTRAIT
     
     c = canvas.Canvas(pdf_path, pagesize=config.STANDARD_PORTRAIT_BLEED)
     c.translate(config.BLEED, config.BLEED)
     
-    if os.path.exists(photo_path):
-        factor = 0.2
-        x = -20
-        y = -5
-        c.drawImage(photo_path, x, y, 3024 * factor, 4032 * factor)
+    for p, x, y, width, height in fullpage_photo_placements(page_dir):
+        c.drawImage(photo_cache.make_derivative(p, width, height), x, y, width, height)
         #c.rect(x, y, 1600 * factor, 1200 * factor)
 
     text_layouts = read_layouts(layout_path)
@@ -165,7 +182,8 @@ def create_fullpage(aids):
     c.showPage()
     c.save()
 
-def create_page(aids):
+@tracing.traced("render", cat="render")
+def create_page(aids, number=None):
 
     print("--", aids)
     
@@ -227,15 +245,21 @@ def create_page(aids):
     if show_chart:
         
         elevations_list = []
+        track_distances_list = [] # cumulative distance of each point, to place elevations on the x axis
         for aid in aids:
             print("----->", aid)
             single_activity = json_utils.load(f"{page_dir}/{aid}.json")
-            e = elevation.get_elevations(single_activity["polyline"], joined_aids, aid)
-            if not e or len(e) == 0:
+            g = geometry.load(aid, single_activity["polyline"], joined_aids) if single_activity["polyline"] else None
+            if g is not None and len(g.elevations) > 0:
+                e = g.elevations
+            else:
+                e = elevation.get_elevations(single_activity["polyline"], joined_aids, aid, fetch=False) # fetched by prefetch.py
+            if e is None or len(e) == 0:
                 show_chart = False
                 print(f"-- no elevation for {aid}")
                 break                
             elevations_list.append(e)
+            track_distances_list.append(g.distances if g is not None else None)
         
         distances_list = []
         
@@ -247,7 +271,7 @@ def create_page(aids):
 
     if show_chart:
         
-        elevation_chart.draw_elevation_chart(c, elevations_list, distances_list, CHART_LEFT = 50, CHART_BOTTOM = 628, chart_width = w / 2 - 53, chart_height = 75)
+        elevation_chart.draw_elevation_chart(c, elevations_list, distances_list, CHART_LEFT = 50, CHART_BOTTOM = 628, chart_width = w / 2 - 53, chart_height = 75, track_distances_list = track_distances_list)
     
     c.setFont("Helvetica", 12)
         
@@ -262,24 +286,18 @@ def create_page(aids):
 
     c.setFont("Helvetica", 14)
 
-    drawing = svg2rlg("icons/distance.svg")
-    drawing.scale(0.022, 0.022)
-    renderPDF.draw(drawing, c, 298, 680-4)
+    icon_cache.draw_icon(c, "icons/distance.svg", 298, 680-4, 0.022)
 
     distance_str = convert_meters_to_kilometers(a["distance"])
     c.drawRightString(380, 680, distance_str)
 
-    drawing = svg2rlg("icons/elevation.svg")
-    drawing.scale(0.025, 0.025)
-    renderPDF.draw(drawing, c, 388, 680-4)
+    icon_cache.draw_icon(c, "icons/elevation.svg", 388, 680-4, 0.025)
 
     d_plus = round(a['total_elevation_gain'])
     elevation_str = f"{d_plus} D+"
     c.drawRightString(463, 680, elevation_str)
 
-    drawing = svg2rlg("icons/time.svg")
-    drawing.scale(0.022, 0.022)
-    renderPDF.draw(drawing, c, 486, 680-4)
+    icon_cache.draw_icon(c, "icons/time.svg", 486, 680-4, 0.022)
 
     duration_str = convert_seconds_to_hms(int(a["elapsed_time"]))
     c.drawRightString(560, 680, duration_str)
@@ -322,13 +340,11 @@ def create_page(aids):
                 #print(s)
                 if subitems_count == 2:
                     break
-                drawing = svg2rlg(ie.icon)
-                drawing.scale(0.018, 0.018)
                 y_pic = y-4
                 #print(ie.icon)
                 if ie.icon == "icons/hut.svg":
                     y_pic += 3
-                renderPDF.draw(drawing, c, 298, y_pic)
+                icon_cache.draw_icon(c, ie.icon, 298, y_pic, 0.018)
                 c.drawString(320, y, s)
                 y -= 20
                 subitems_count += 1
@@ -357,6 +373,10 @@ def create_page(aids):
     if os.path.exists(map_path):
         c.drawImage(map_path, map_x, map_y, map_w, map_h)
         c.line(map_x, map_y+map_h, map_x+map_w, map_y+map_h)
+    
+    # page number, tags and cut marks
+    if number is not None:
+        page_decorations.draw(c, number, squared=True, tags=page_decorations.tags_for_meta(meta))
             
     # Save the page
     c.showPage()
@@ -0,0 +1,161 @@
+from collections import namedtuple
+
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+
+import config
+
+# Page numbers, tags and cut marks, drawn by the page renderers themselves
+# (page_creator.py, index_creator.py and the padding pages of book.py) on canvases
+# translated by config.BLEED, so that assembling the book only concatenates pages.
+#
+# Page numbers are assigned before rendering, from the position of the page in activities_ids.json.
+# Cut marks are the same on every page, they are drawn once per file as a Form XObject.
+
+Tag = namedtuple('Tag', ['text', 'color'])
+
+CUT_MARKS_FORM = "cut_marks"
+
+def tags_for_meta(meta):
+
+    tags = []
+
+    if meta:
+        if "Course" in meta and meta["Course"] == True:
+            tags.append(Tag(text="Course", color=colors.red))
+        if "Trail" in meta and meta["Trail"] == True:
+            tags.append(Tag(text="Trail", color=colors.green))
+
+    return tags
+
+def add_tag(c, tag, top_right=False):
+
+    if not tag:
+        return
+
+    c.saveState()
+
+    y = 715
+    w = 60
+    h = 26
+
+    if top_right:
+        x = 500
+        rotate_angle = -30
+    else:
+        x = 15
+        rotate_angle = 30
+
+    # Translate and rotate for the tag
+    c.translate(x + w/2, y + h/2)  # Move the origin to the center of the tag
+    c.rotate(rotate_angle)  # Rotate 30 degrees counterclockwise
+
+    # Move back the origin for drawing the rectangle
+    c.translate(-w / 2, -h / 2)
+
+    # Draw the tag - a rounded rectangle
+    c.setFillColor(tag.color)
+    corner_radius = 10
+    c.roundRect(0, 0, w, h, corner_radius, fill=1)
+
+    # Set the font and size for the label
+    c.setFont("Helvetica-Bold", 14) # macOS
+    c.setFillColor(colors.white)
+
+    # Label the tag with the provided text
+    c.drawCentredString(w / 2, h / 2 - 4, tag.text)
+
+    # Restore the canvas state
+    c.restoreState()
+
+def draw_cut_marks(c, page_width, page_height, bleed):
+
+    t = 0.15 * cm
+
+    c.saveState()
+
+    c.setLineWidth(0.5)
+
+    c.setStrokeColorRGB(1, 0, 0)  # Set the color for cut marks
+
+    c.translate(-bleed, -bleed)
+
+    # bottom left
+    c.line(0, bleed, t, bleed) # -
+    c.line(bleed, 0, bleed, t) # |
+
+    # bottom right
+    c.line(page_width, bleed, page_width - t, bleed) # -
+    c.line(page_width - bleed, 0, page_width - bleed, t) # |
+
+    # top left
+    c.line(0, page_height - bleed, t, page_height - bleed) # -
+    c.line(bleed, page_height, bleed, page_height - t) # |
+
+    # top right
+    c.line(page_width - t, page_height - bleed, page_width, page_height - bleed) # -
+    c.line(page_width - bleed, page_height, page_width - bleed, page_height - t) # |
+
+    c.restoreState()
+
+def draw_cut_marks_form(c):
+
+    w, h = config.STANDARD_PORTRAIT_BLEED
+
+    if not c.hasForm(CUT_MARKS_FORM):
+        c.beginForm(CUT_MARKS_FORM, -config.BLEED, -config.BLEED, w - config.BLEED, h - config.BLEED)
+        draw_cut_marks(c, w, h, config.BLEED)
+        c.endForm()
+
+    c.doForm(CUT_MARKS_FORM)
+
+def draw(c, number, squared, tags):
+    """
+    Draws the page number, tags and cut marks on top of the page.
+    The origin of c is the corner of the trimmed page, see config.BLEED.
+    """
+
+    w, h = config.STANDARD_PORTRAIT_BLEED
+
+    c.saveState()
+
+    c.setLineWidth(0.5)
+    c.setStrokeColor(colors.black)
+    c.setFont("Helvetica", 10)
+
+    is_odd_page = number % 2 == 0
+
+    if is_odd_page == 0:
+        x_position = w - 60
+    else:
+        x_position = 40
+
+    y_position = 20
+
+    if squared:
+        c.setFillColor(colors.white)
+        c.rect(x_position - 10, y_position - 5, 20, 15, stroke=1, fill=1)
+    c.setFillColor(colors.black)
+    c.drawCentredString(x_position, y_position, str(number))
+
+    if tags and len(tags) >= 1:
+        add_tag(c, tags[0], top_right= not is_odd_page)
+    if tags and len(tags) == 2:
+        add_tag(c, tags[1], top_right= is_odd_page)
+
+    draw_cut_marks_form(c)
+
+    c.restoreState()
+
+def create_empty_pages(path, first_number, count):
+    # numbered blank pages, to pad the book
+
+    c = canvas.Canvas(path, pagesize=config.STANDARD_PORTRAIT_BLEED)
+
+    for i in range(count):
+        c.translate(config.BLEED, config.BLEED)
+        draw(c, first_number + i, squared=False, tags=None)
+        c.showPage()
+
+    c.save()
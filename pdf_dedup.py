@@ -0,0 +1,81 @@
+import hashlib
+import itertools
+from io import BytesIO
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+# Hashes of PDF objects, to keep only one copy of identical objects in the book, see pdf_stream.py.
+#
+# Each page PDF brings its own copies of fonts, icon forms, images and resources, so that the book
+# holds the same objects many times. Objects are hashed Merkle-style: the hash of an object covers its
+# content and the hashes of the objects it references, so that two identical images, font programs or
+# icon forms (and the resources dicts pointing to them) get the same digest wherever they come from.
+# References to duplicates are then pointed at the first copy.
+
+UNIQUE_TYPES = ("/Page", "/Pages", "/Catalog") # never merged, and their references are not followed
+
+_digesters = itertools.count() # unique digests differ between files
+
+def _sha1(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p)
+    return h.digest()
+
+def _serialized(obj):
+    b = BytesIO()
+    obj.write_to_stream(b, None)
+    return b.getvalue()
+
+def digest(obj, object_digest):
+    """
+    Hash of a direct object, where references are replaced by object_digest(idnum).
+    """
+
+    if isinstance(obj, IndirectObject):
+        return _sha1(b"R", object_digest(obj.idnum))
+
+    if isinstance(obj, DictionaryObject):
+        parts = [b"<<"]
+        for k in sorted(obj.keys()):
+            parts += [k.encode("latin-1"), digest(obj[k], object_digest)]
+        if isinstance(obj, StreamObject):
+            parts += [b"stream", obj._data]
+        return _sha1(*parts)
+
+    if isinstance(obj, ArrayObject):
+        return _sha1(b"[", *[digest(o, object_digest) for o in obj])
+
+    return _sha1(type(obj).__name__.encode(), _serialized(obj))
+
+def object_digester(get_object):
+    """
+    get_object(idnum) -> object, None if missing.
+    Returns object_digest(idnum), memoized. Digests of pages and of objects within a reference cycle
+    are unique: their references are not followed.
+    """
+
+    digests = {}
+    pending = set()
+    salt = str(next(_digesters)).encode()
+
+    def object_digest(idnum):
+        if idnum in digests:
+            return digests[idnum]
+
+        obj = get_object(idnum)
+
+        if obj is None or idnum in pending or is_unique(obj):
+            return _sha1(b"id", salt, str(idnum).encode())
+
+        pending.add(idnum)
+        d = digest(obj, object_digest)
+        pending.discard(idnum)
+
+        digests[idnum] = d
+        return d
+
+    return object_digest
+
+def is_unique(obj):
+    return isinstance(obj, DictionaryObject) and obj.get("/Type") in UNIQUE_TYPES
@@ -0,0 +1,160 @@
+import os
+import zlib
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, NumberObject, StreamObject
+
+import pdf_dedup
+import tracing
+
+# Writes the book one page PDF at a time, in bounded memory.
+#
+# The objects of each page PDF are written to the output as soon as it is read, then its reader is
+# released, so that memory is bounded by the largest page instead of growing with the book.
+# Only the xref offsets and the digests of the objects already written are kept: an object whose digest
+# was already written (see pdf_dedup.py) is referenced instead of written again.
+# Streams without filter are flate-compressed on their way out.
+#
+# Object 1 is the catalog and object 2 the pages tree, both written when the book is closed.
+
+PDF_HEADER = b"%PDF-1.4\n%\xE2\xE3\xCF\xD3\n"
+CATALOG_ID = 1
+PAGES_ID = 2
+
+class BookWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.f = None
+        self.offsets = {} # idnum -> offset in the file
+        self.next_id = PAGES_ID + 1
+        self.written = {} # digest -> idnum
+        self.kids = [] # idnums of the pages
+        self.duplicates = 0
+        self.bytes_read = 0
+
+    def __enter__(self):
+        self.f = open(self.tmp_path, "wb")
+        self.f.write(PDF_HEADER)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.tmp_path)
+
+    def _new_id(self):
+        idnum = self.next_id
+        self.next_id += 1
+        return idnum
+
+    def _write_object(self, idnum, obj):
+        self.offsets[idnum] = self.f.tell()
+        self.f.write(f"{idnum} 0 obj\n".encode())
+        obj.write_to_stream(self.f, None)
+        self.f.write(b"\nendobj\n")
+
+    def _copy(self, obj, copy_reference):
+        # direct copy of obj, with references to the objects of the book
+
+        if isinstance(obj, IndirectObject):
+            idnum = copy_reference(obj.idnum)
+            return IndirectObject(idnum, 0, None) if idnum else NullObject()
+
+        if isinstance(obj, StreamObject):
+            s = StreamObject()
+            for k, v in obj.items():
+                if k != "/Length": # written with the data
+                    s[k] = self._copy(v, copy_reference)
+            s._data = obj._data
+            if "/Filter" not in s:
+                s._data = zlib.compress(s._data)
+                s[NameObject("/Filter")] = NameObject("/FlateDecode")
+            return s
+
+        if isinstance(obj, DictionaryObject):
+            return DictionaryObject({k: self._copy(v, copy_reference) for k, v in obj.items()})
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._copy(v, copy_reference) for v in obj])
+
+        return obj
+
+    @tracing.traced("add pdf", cat="assemble")
+    def add_pdf(self, path):
+        """
+        Appends the pages of the PDF file at path, returns the number of pages added.
+        """
+
+        self.bytes_read += os.path.getsize(path)
+        duplicates = self.duplicates
+
+        reader = PdfReader(path)
+
+        def get_object(idnum):
+            return reader.get_object(IndirectObject(idnum, 0, reader))
+
+        object_digest = pdf_dedup.object_digester(get_object)
+        copied = {} # idnum in reader -> idnum in the book
+
+        def copy_reference(idnum):
+
+            if idnum in copied:
+                return copied[idnum]
+
+            obj = get_object(idnum)
+            if obj is None or pdf_dedup.is_unique(obj):
+                return None # pages are only referenced by the pages tree
+
+            d = object_digest(idnum)
+            if d in self.written:
+                self.duplicates += 1
+                copied[idnum] = self.written[d]
+                return copied[idnum]
+
+            copied[idnum] = self.written[d] = self._new_id()
+            self._write_object(copied[idnum], self._copy(obj, copy_reference))
+            return copied[idnum]
+
+        for page in reader.pages:
+            # inherited attributes were copied into the page by PdfReader
+            p = DictionaryObject({k: self._copy(v, copy_reference) for k, v in page.items() if k != "/Parent"})
+            p[NameObject("/Parent")] = IndirectObject(PAGES_ID, 0, None)
+
+            idnum = self._new_id()
+            self._write_object(idnum, p)
+            self.kids.append(idnum)
+
+        tracing.count("pdf duplicate objects", self.duplicates - duplicates)
+
+        return len(reader.pages)
+
+    def close(self):
+
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject([IndirectObject(i, 0, None) for i in self.kids]),
+            NameObject("/Count"): NumberObject(len(self.kids)),
+        })
+        self._write_object(PAGES_ID, pages)
+
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(PAGES_ID, 0, None),
+        })
+        self._write_object(CATALOG_ID, catalog)
+
+        xref_offset = self.f.tell()
+        self.f.write(f"xref\n0 {self.next_id}\n".encode())
+        self.f.write(b"0000000000 65535 f \n")
+        for idnum in range(1, self.next_id):
+            self.f.write(f"{self.offsets[idnum]:010} 00000 n \n".encode())
+
+        self.f.write(f"trailer\n<< /Size {self.next_id} /Root {CATALOG_ID} 0 R >>\n".encode())
+        self.f.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
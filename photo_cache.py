@@ -0,0 +1,131 @@
+import os
+import time
+
+from PIL import Image, ImageOps
+
+import config
+import json_utils
+import build_manifest
+import render_pool
+import tracing
+
+# Photos are embedded at their placed size instead of full resolution: each photo is resampled to
+# config.PHOTO_DPI for the size it is drawn at, turned according to its EXIF orientation, and cached in
+# PHOTO_CACHE_DIR under the hash of its content, so that renaming or moving a photo keeps its derivative.
+#
+# book.py runs preprocess() over the render processes (see render_pool.py) before rendering the pages,
+# then page_creator.py only reads the derivatives.
+# Photos smaller than their placed size, with no orientation to apply, are embedded as they are.
+
+PHOTO_CACHE_DIR = "photo_cache"
+DIGESTS_FILE = f"{PHOTO_CACHE_DIR}/digests.json" # {path: [size, mtime_ns, sha1]}, see build_manifest.file_digest()
+
+_digests = None
+
+def digests():
+    global _digests
+    if _digests is None:
+        files = json_utils.load(DIGESTS_FILE) if os.path.exists(DIGESTS_FILE) else None
+        _digests = {"files": files or {}}
+    return _digests
+
+def save_digests():
+    os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+    files = {p: v for p, v in digests()["files"].items() if os.path.exists(p)}
+    json_utils.dump(files, DIGESTS_FILE)
+
+def target_size(width_pt, height_pt):
+    return max(1, round(width_pt / 72 * config.PHOTO_DPI)), max(1, round(height_pt / 72 * config.PHOTO_DPI))
+
+def derivative_path(src, width_pt, height_pt):
+    w, h = target_size(width_pt, height_pt)
+    digest = build_manifest.file_digest(src, digests())
+    return f"{PHOTO_CACHE_DIR}/{digest}_{w}x{h}_q{config.PHOTO_JPEG_QUALITY}.jpg"
+
+def embedded_as_is(img, w, h):
+    orientation = img.getexif().get(0x0112, 1)
+    return orientation == 1 and img.width <= w and img.height <= h
+
+def needs_derivative(src, width_pt, height_pt):
+    if os.path.exists(derivative_path(src, width_pt, height_pt)):
+        return False
+    try:
+        with Image.open(src) as img: # reads the header only
+            return not embedded_as_is(img, *target_size(width_pt, height_pt))
+    except OSError:
+        return False
+
+@tracing.traced("photo", cat="render")
+def make_derivative(src, width_pt, height_pt):
+    """
+    Path of the image to draw for src placed at width_pt x height_pt, created if needed.
+    """
+
+    if not os.path.exists(src):
+        return src
+
+    path = derivative_path(src, width_pt, height_pt)
+    if os.path.exists(path):
+        tracing.count("photo cache hit")
+        return path
+
+    tracing.count("photo cache miss")
+
+    w, h = target_size(width_pt, height_pt)
+
+    try:
+        with Image.open(src) as img:
+
+            if embedded_as_is(img, w, h):
+                return src # nothing to gain
+
+            img = ImageOps.exif_transpose(img)
+
+            # drawImage() stretches images to their box, so does the resampling
+            if img.width > w or img.height > h:
+                img = img.resize((min(w, img.width), min(h, img.height)), Image.LANCZOS)
+
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            img.save(tmp_path, "JPEG", quality=config.PHOTO_JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+
+    except OSError as e:
+        print(f"** can't resample {src}: {e}")
+        return src
+
+    return path
+
+def missing_derivatives(photos):
+    """
+    photos: [(path, width_pt, height_pt), ...]
+    Returns the photos whose derivative must be made, see make_derivative().
+    """
+
+    photos = sorted(set(p for p in photos if os.path.exists(p[0])))
+    if not photos:
+        return []
+
+    # hashing happens here once, workers reuse the saved digests
+    missing = [p for p in photos if needs_derivative(*p)]
+    save_digests()
+
+    return missing
+
+def preprocess(photos, use_parallelism=True):
+    """
+    photos: [(path, width_pt, height_pt), ...]
+    """
+
+    missing = missing_derivatives(photos)
+    if not missing:
+        return
+
+    t = time.time()
+
+    render_pool.starmap(make_derivative, missing, use_parallelism)
+
+    print(f"-- resampled {len(missing)} photos in {time.time() - t:.1f} s")
@@ -1,33 +1,170 @@
+import numpy as np
+
+# Encoded polylines, https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+#
+# Decoding works on the bytes of many polylines at once with numpy instead of one character at a time:
+# each byte holds 5 bits of a value, bytes < 0x20 (after subtracting 63) end a value,
+# values alternate lat / lon deltas, and coordinates are the cumulative sums of the deltas, polyline by polyline.
+
+PRECISION = 5
+FACTOR = 10 ** PRECISION
+
+MAX_CHUNKS = 7 # 5 bits chunks of a 32 bits zigzag value
+
+def _buffer(s):
+    return np.frombuffer(s.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+
+def _values(b):
+    # zigzag-decoded values of a buffer, and the mask of the last byte of each value
+
+    is_last = b < 0x20
+    ends = np.flatnonzero(is_last)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.int64), is_last
+
+    b = b[:ends[-1] + 1] # ignores an unterminated value
+
+    # position of each byte in its value, gives its shift
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    value_index = np.concatenate([[0], np.cumsum(is_last[:len(b)])[:-1]])
+    shifts = 5 * (np.arange(len(b)) - starts[value_index])
+
+    values = np.add.reduceat((b & 0x1f) << shifts, starts) # chunks don't overlap, + is |
+    return np.where(values & 1, ~(values >> 1), values >> 1), is_last
+
+def _is_canonical(b, is_last):
+    # what encode() would write: printable characters, no useless trailing chunk
+    if not np.all((b >= 0) & (b < 64)):
+        return False
+    follows_chunk = np.concatenate([[False], ~is_last[:-1]])
+    return not np.any(is_last & (b == 0) & follows_chunk)
+
+def decode_many(polylines, as_int=False):
+    """
+    Decodes a list of polylines at once.
+    Returns (coords, offsets): coords is a (n, 2) array of (lat, lon), float64 degrees, or int32 1e-5 degrees with as_int.
+    The points of polylines[i] are coords[offsets[i]:offsets[i+1]].
+    """
+
+    lengths = np.array([len(p) for p in polylines], dtype=np.int64)
+    byte_offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    b = _buffer("".join(polylines))
+    values, is_last = _values(b)
+
+    # number of values before each polyline
+    values_before = np.concatenate([[0], np.cumsum(is_last)])[byte_offsets]
+    if np.any(values_before % 2) or (len(b) > 0 and not is_last[-1]):
+        raise ValueError("malformed polyline")
+
+    offsets = values_before // 2
+
+    # cumulative sums restarting at each polyline
+    coords = np.cumsum(values.reshape(-1, 2), axis=0)
+    counts = np.diff(offsets)
+    firsts = offsets[:-1][counts > 0]
+    bases = np.zeros((len(firsts), 2), dtype=np.int64)
+    bases[firsts > 0] = coords[firsts[firsts > 0] - 1]
+    coords -= np.repeat(bases, counts[counts > 0], axis=0)
+
+    if as_int:
+        return coords.astype(np.int32), offsets
+
+    return coords / FACTOR, offsets
+
+def decode(p, as_int=False):
+    coords, _ = decode_many([p], as_int)
+    return coords
+
+def encode(coords):
+    """
+    Encodes a (n, 2) array or list of (lat, lon), in degrees, or in 1e-5 degrees if its dtype is integer.
+    """
+
+    coords = np.asarray(coords)
+    if len(coords) == 0:
+        return ""
+
+    if np.issubdtype(coords.dtype, np.integer):
+        ints = coords.astype(np.int64)
+    else:
+        # round half away from zero, like the reference implementation
+        scaled = coords.astype(np.float64) * FACTOR
+        ints = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).reshape(-1)
+
+    values = deltas << 1
+    values = np.where(deltas < 0, ~values, values)
+
+    chunks = (values[:, None] >> (5 * np.arange(MAX_CHUNKS))) & 0x1f
+    n_chunks = 1 + np.sum((values[:, None] >> (5 * np.arange(1, MAX_CHUNKS))) > 0, axis=1)
+
+    used = np.arange(MAX_CHUNKS) < n_chunks[:, None]
+    more = np.arange(MAX_CHUNKS) < (n_chunks - 1)[:, None]
+    chars = (chunks | np.where(more, 0x20, 0)) + 63
+
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+def concat(polylines, points=None):
+    """
+    Joins polylines without building their coordinates or re-encoding them: only the first point of
+    each polyline is rewritten, relative to the last point of the previous one.
+    points[i], optional, is (first point, last point, number of points) of polylines[i] in 1e-5 degrees,
+    from the geometry cache, otherwise they are summed from the values.
+    Returns (polyline, counts), counts[i] is the number of points of polylines[i].
+    Same result as encode(decode_many(polylines)[0]).
+    """
+
+    parts = []
+    counts = []
+    last = np.zeros(2, dtype=np.int64) # last point so far, 1e-5 degrees
+
+    for i, p in enumerate(polylines):
+
+        b = _buffer(p)
+        is_last = b < 0x20
+        known = points[i] if points else None
+
+        if known is not None and _is_canonical(b, is_last):
+            first, end, count = known
+        else:
+            values, is_last = _values(b)
+            if len(values) % 2 or (len(b) > 0 and not is_last[-1]):
+                raise ValueError("malformed polyline")
+
+            deltas = values.reshape(-1, 2)
+            first, end, count = deltas[0] if len(deltas) else None, deltas.sum(axis=0), len(deltas)
+
+            if count and not _is_canonical(b, is_last):
+                p = encode(np.cumsum(deltas, axis=0))
+                is_last = _buffer(p) < 0x20
+
+        counts.append(count)
+        if count == 0:
+            continue
+
+        # the first point is encoded from (0, 0), its 2 values end at the 2nd terminator
+        first_len = np.flatnonzero(is_last)[1] + 1
+        parts.append(encode((np.asarray(first, dtype=np.int64) - last)[None, :]))
+        parts.append(p[first_len:])
+
+        last = np.asarray(end, dtype=np.int64)
+
+    return "".join(parts), counts
+
 def decode_polyline_lat_lon(p, only_first=False): # [(float, float), (float, float), ...]
 
-    # adapted from https://github.com/frederickjansen/polyline/blob/master/src/polyline/polyline.py
-
-    def _trans(value, index):
-        byte, result, shift = None, 0, 0
-    
-        comp = None
-        while byte is None or byte >= 0x20:
-            byte = ord(value[index]) - 63
-            index += 1
-            result |= (byte & 0x1f) << shift
-            shift += 5
-            comp = result & 1
-    
-        return ~(result >> 1) if comp else (result >> 1), index
-
-    coordinates, index, lat, lng, length = [], 0, 0, 0, len(p)
-
-    while index < length:
-        lat_change, index = _trans(p, index)
-        lng_change, index = _trans(p, index)
-        lat += lat_change
-        lng += lng_change
-        
-        lat_lon_tuple = (lat / 10 ** 5, lng / 10 ** 5)
-        
-        if only_first:
-            return [lat_lon_tuple]
-        
-        coordinates.append(lat_lon_tuple)
-
-    return coordinates
+    if only_first:
+        # only the bytes of the first lat / lon values
+        ends = 0
+        for i, c in enumerate(p):
+            if ord(c) - 63 < 0x20:
+                ends += 1
+                if ends == 2:
+                    p = p[:i+1]
+                    break
+
+    coords = decode(p)
+
+    return [tuple(c) for c in coords.tolist()]
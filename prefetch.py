@@ -0,0 +1,157 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+import json_utils
+import transport
+import geocoding
+import geocode_cache
+import map_maker
+import elevation
+import tracing
+
+# Fetches all the missing network resources of the book before rendering:
+# place names (geocoding), maps and elevations.
+#
+# Requests run concurrently, with at most config.PREFETCH_WORKERS in flight over pooled connections.
+# Each result is saved as soon as it arrives, so an interrupted prefetch resumes where it stopped.
+# Render workers then only read files and never wait on HTTP.
+
+def missing_tasks(activity_ids):
+
+    tasks = [] # [(kind, aids, aid), ...]
+    polylines = set() # identical polylines share their elevations
+
+    for aids in activity_ids:
+
+        if type(aids[0]) == str:
+            continue # full page photo
+
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        page_dir = f"{config.PAGES_DIR}/{joined_aids}"
+
+        processed = json_utils.load(f"{page_dir}/{joined_aids}_processed.json")
+        if processed and "place_name" not in processed:
+            tasks.append(("geocode", aids, None))
+
+        if not os.path.exists(map_maker.map_file_path(aids)):
+            tasks.append(("map", aids, None))
+
+        for aid in aids:
+            if config.ELEVATION_BACKEND == "dem":
+                break # computed offline while rendering
+            if not os.path.exists(f"{page_dir}/{aid}.json"):
+                continue
+            p = json_utils.load(f"{page_dir}/{aid}.json").get("polyline")
+            if not p or p in polylines:
+                continue
+            polylines.add(p)
+            if not elevation.has_elevations(p, joined_aids, aid):
+                tasks.append(("elevation", aids, aid))
+
+    return tasks
+
+def dependencies(activity_ids, tasks):
+    """
+    Returns {joined_aids: [indices in tasks]}, the tasks each page waits for before rendering.
+    Elevations are fetched once per polyline, for all the pages sharing it.
+    """
+
+    def polyline(aids, aid):
+        path = f"{config.PAGES_DIR}/{'_'.join([str(aid) for aid in aids])}/{aid}.json"
+        return json_utils.load(path).get("polyline") if os.path.exists(path) else None
+
+    by_page = {} # joined_aids -> [i, ...]
+    by_polyline = {} # polyline -> i
+    for i, (kind, aids, aid) in enumerate(tasks):
+        if kind == "elevation":
+            by_polyline[polyline(aids, aid)] = i
+        else:
+            by_page.setdefault('_'.join([str(aid) for aid in aids]), []).append(i)
+
+    deps = {}
+    for aids in activity_ids:
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        deps[joined_aids] = list(by_page.get(joined_aids, []))
+        if by_polyline and type(aids[0]) != str:
+            for aid in aids:
+                p = polyline(aids, aid)
+                if p in by_polyline:
+                    deps[joined_aids].append(by_polyline[p])
+
+    return deps
+
+def check_api_keys(tasks):
+
+    if not transport.needs_api_keys():
+        return
+
+    kinds = {kind for kind, _, _ in tasks}
+
+    if kinds & {"geocode", "map"} and len(config.MAPTILER_API_KEY) == 0:
+        print("(!) MAPTILER_API_KEY is missing")
+        sys.exit(1)
+
+    if "elevation" in kinds and len(config.STADIA_API_KEY) == 0:
+        print("(!) STADIA_API_KEY is missing")
+        sys.exit(1)
+
+@tracing.traced("fetch", cat="network")
+def run_task(session, kind, aids, aid):
+
+    joined_aids = '_'.join([str(aid) for aid in aids])
+
+    if kind == "geocode":
+        place_name = geocoding.fetch_geo(aids, session)
+        if place_name:
+            activity_file = f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}_processed.json"
+            a = json_utils.load(activity_file)
+            a["place_name"] = place_name
+            json_utils.dump(a, activity_file)
+
+    elif kind == "map":
+        map_maker.get_map(aids, session)
+
+    elif kind == "elevation":
+        a = json_utils.load(f"{config.PAGES_DIR}/{joined_aids}/{aid}.json")
+        if a and a.get("polyline"):
+            elevation.get_elevations(a["polyline"], joined_aids, aid) # pooled session with retries
+
+@tracing.traced("prefetch", cat="stage")
+def prefetch(activity_ids, max_workers=None):
+
+    max_workers = max_workers or config.PREFETCH_WORKERS
+
+    tasks = missing_tasks(activity_ids)
+    if not tasks:
+        print("-- prefetch: nothing to fetch")
+        return
+
+    check_api_keys(tasks)
+
+    session = transport.new_session(max_workers)
+    total = len(tasks)
+    failed = 0
+
+    print(f"-- prefetch: {total} resources to fetch")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        futures = {executor.submit(run_task, session, *t): t for t in tasks}
+
+        for done, f in enumerate(as_completed(futures), start=1):
+            kind, aids, aid = futures[f]
+            try:
+                f.result()
+                status = "ok"
+            except Exception as e:
+                failed += 1
+                status = f"failed: {e}"
+            print(f"-- prefetch [{done}/{total}] {kind} {aid if aid else aids} {status}")
+
+    geocode_cache.get_cache().save()
+    print(f"-- geocode cache: {geocode_cache.get_cache().stats()}")
+
+    if failed:
+        print(f"** prefetch: {failed} of {total} resources failed, run again to resume")
@@ -0,0 +1,97 @@
+import atexit
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import tracing
+
+# Render processes, started once and kept warm between builds.
+#
+# Each worker runs init_worker() once, before its first task: the renderer modules are imported, the
+# locale is set, and the fonts and SVG icons are loaded, instead of on every page.
+# The pool lives until the process exits, so that book.py --watch renders every rebuild on the same workers.
+# Used by the scheduler (see scheduler.py), the phased build and photo resampling.
+
+FONTS = ("Helvetica", "Helvetica-Bold", "Times-Roman", "Times-Bold")
+ICONS_DIR = "icons"
+
+_executor = None
+
+def register_fonts():
+
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfbase import pdfmetrics
+
+    pdfmetrics.registerFont(TTFont('Helvetica', '/System/Library/Fonts/Helvetica.ttc'))
+    pdfmetrics.registerFont(TTFont('Times',     '/System/Library/Fonts/Times.ttc'))
+
+def init_worker():
+
+    from reportlab.pdfbase import pdfmetrics
+
+    import page_creator
+    import index_creator
+    import icon_cache
+
+    tracing.init_process()
+    register_fonts()
+    page_creator.init()
+
+    for name in FONTS:
+        pdfmetrics.getFont(name)
+
+    for path in sorted(glob.glob(f"{ICONS_DIR}/*.svg")):
+        icon_cache.get_drawing(path)
+
+def executor():
+
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=config.RENDER_WORKERS, initializer=init_worker)
+        atexit.register(shutdown)
+
+    return _executor
+
+def shutdown(wait=True):
+
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
+
+def submit(fn, *args):
+
+    # a worker died (eg. killed) and broke the pool in a previous task: start a new one
+    try:
+        return executor().submit(fn, *args)
+    except BrokenProcessPool:
+        shutdown(wait=False)
+        return executor().submit(fn, *args)
+
+def chunksize(n):
+
+    if config.RENDER_CHUNKSIZE:
+        return config.RENDER_CHUNKSIZE
+
+    # a few chunks per worker, so that slow pages don't leave workers idle at the end
+    workers = config.RENDER_WORKERS or os.cpu_count() or 1
+    return max(1, n // (workers * 4))
+
+def starmap(fn, args_list, use_parallelism=True):
+
+    if not args_list:
+        return []
+
+    if not use_parallelism:
+        init_worker()
+        return [fn(*args) for args in args_list]
+
+    try:
+        return list(executor().map(fn, *zip(*args_list), chunksize=chunksize(len(args_list))))
+    except BrokenProcessPool:
+        shutdown(wait=False) # the next call starts a new pool
+        raise
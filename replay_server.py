@@ -0,0 +1,161 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import config
+import transport
+
+# Local stand-in for Strava, MapTiler and Stadia, serving the responses recorded with
+# config.HTTP_MODE = "record", to run and benchmark the whole pipeline without network.
+#
+#     python3 replay_server.py --latency 0.2 --jitter 0.1 --error-rate 0.05 --rate-limit 100,1000 --window 60
+#
+# then run the scripts with config.HTTP_MODE = "replay".
+#
+# Requests arrive as /{host}/{path}?{query}, see transport.ReplaySession.
+# GET /__stats__ returns the counters as JSON: requests, misses, errors, throttled and max concurrency.
+
+class ReplayState:
+
+    def __init__(self, latency, jitter, error_rate, rate_limit, window):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit # (short, daily) or None
+        self.window = window         # seconds, the short window, 900 at Strava
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.usage = [0, 0]
+        self.in_flight = 0
+        self.stats = {"requests": 0, "misses": 0, "errors": 0, "throttled": 0, "max_concurrency": 0}
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            self.stats["max_concurrency"] = max(self.stats["max_concurrency"], self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def consume(self):
+        # Strava-like usage counters, returns (headers, throttled)
+        if not self.rate_limit:
+            return {}, False
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.usage[0] = 0
+            self.usage[0] += 1
+            self.usage[1] += 1
+            throttled = self.usage[0] > self.rate_limit[0] or self.usage[1] > self.rate_limit[1]
+            if throttled:
+                self.stats["throttled"] += 1
+            headers = {
+                "X-RateLimit-Limit": f"{self.rate_limit[0]},{self.rate_limit[1]}",
+                "X-RateLimit-Usage": f"{self.usage[0]},{self.usage[1]}"
+            }
+            return headers, throttled
+
+def make_handler(state):
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+
+        protocol_version = "HTTP/1.1" # keep-alive, like the real services
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/__stats__":
+                with state.lock:
+                    self.reply(200, {"Content-Type": "application/json"}, json.dumps(state.stats).encode('utf-8'))
+                return
+            self.replay("GET")
+
+        def do_POST(self):
+            self.replay("POST")
+
+        def replay(self, method):
+
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+
+            state.enter()
+            try:
+                if state.latency or state.jitter:
+                    time.sleep(max(0, state.latency + random.uniform(-state.jitter, state.jitter)))
+
+                rate_headers, throttled = state.consume()
+                if throttled:
+                    self.reply(429, rate_headers, b'{"message": "Rate Limit Exceeded"}')
+                    return
+
+                if state.error_rate and random.random() < state.error_rate:
+                    state.count("errors")
+                    self.reply(503, rate_headers, b'{"message": "Service Unavailable"}')
+                    return
+
+                parts = urlsplit(self.path)
+                key = transport.cassette_key(method, parts.path.lstrip("/"), parts.query, body)
+                cassette = transport.load_cassette(key)
+
+                if not cassette:
+                    state.count("misses")
+                    print(f"** no recorded response for {method} {self.path}")
+                    self.reply(404, rate_headers, b'{"message": "Not recorded"}')
+                    return
+
+                headers = dict(cassette["headers"])
+                headers.update(rate_headers)
+                self.reply(cassette["status"], headers, cassette["body"])
+            finally:
+                state.leave()
+
+        def reply(self, status, headers, body):
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ReplayHandler
+
+def serve(port, state):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    print(f"-- replaying {config.HTTP_CASSETTES_DIR} on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"-- {state.stats}")
+
+def main():
+    parser = argparse.ArgumentParser(description="replay_server.py options")
+    parser.add_argument('-p', '--port', type=int, default=int(urlsplit(config.HTTP_REPLAY_URL).port or 8777), help="Port")
+    parser.add_argument('--latency', type=float, default=0.0, help="Delay added to each response, in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random variation of the delay, in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--rate-limit', type=str, default=None, help="Short and daily limits, eg. 100,1000, answered with 429 beyond")
+    parser.add_argument('--window', type=float, default=900, help="Duration of the short rate limit window, in seconds")
+    args = parser.parse_args()
+
+    rate_limit = tuple(int(n) for n in args.rate_limit.split(",")) if args.rate_limit else None
+
+    state = ReplayState(args.latency, args.jitter, args.error_rate, rate_limit, args.window)
+    serve(args.port, state)
+
+if __name__ == "__main__":
+    main()
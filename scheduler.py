@@ -0,0 +1,103 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import config
+import render_pool
+
+# Runs the tasks of a build as soon as their dependencies are done, instead of phase after phase,
+# so that a build takes about as long as its longest chain of tasks rather than the sum of its phases.
+# book.build() declares the tasks of each page: place name, map and elevations -> photos -> render -> add to the book.
+#
+# Each task runs in a lane:
+#   "io"   thread pool, for network requests (config.PREFETCH_WORKERS)
+#   "cpu"  process pool, for photos and rendering (the warm workers of render_pool.py)
+#   "main" main thread, between completions, for what must happen in order (writing the book)
+#
+# A failed task is reported and its dependents still run, with what is on disk, as the phases did.
+
+LANES = ("io", "cpu", "main")
+
+class Scheduler:
+
+    def __init__(self, io_workers=None):
+        self.io_workers = io_workers or config.PREFETCH_WORKERS
+        self.tasks = {} # key -> (lane, fn, args, deps), in insertion order
+        self.results = {}
+        self.failed = {} # key -> exception
+
+    def add(self, key, lane, fn, *args, deps=()):
+        """
+        Adds a task, once its dependencies were added. Returns key.
+        """
+
+        assert lane in LANES, lane
+        assert key not in self.tasks, key
+
+        deps = [d for d in deps if d is not None]
+        for d in deps:
+            assert d in self.tasks, f"unknown dependency {d} of {key}"
+
+        self.tasks[key] = (lane, fn, args, deps)
+        return key
+
+    def _call(self, key, fn, args):
+        try:
+            self.results[key] = fn(*args)
+        except Exception as e:
+            self.failed[key] = e
+            print(f"** {key} failed: {e}")
+
+    def run(self):
+
+        t = time.time()
+
+        remaining = {key: set(deps) for key, (_, _, _, deps) in self.tasks.items()}
+        dependents = {key: [] for key in self.tasks}
+        for key, (_, _, _, deps) in self.tasks.items():
+            for d in deps:
+                dependents[d].append(key)
+
+        ready = deque(key for key, deps in remaining.items() if not deps)
+        running = {} # future -> key
+
+        def finished(key):
+            for k in dependents[key]:
+                remaining[k].discard(key)
+                if not remaining[k]:
+                    ready.append(k)
+
+        # with fork, start the workers before any thread
+        render_pool.submit(int).result()
+
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io:
+
+            while ready or running:
+
+                while ready:
+                    key = ready.popleft()
+                    lane, fn, args, _ = self.tasks[key]
+                    if lane == "main":
+                        self._call(key, fn, args)
+                        finished(key)
+                    else:
+                        running[io.submit(fn, *args) if lane == "io" else render_pool.submit(fn, *args)] = key
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for f in done:
+                    key = running.pop(f)
+                    try:
+                        self.results[key] = f.result()
+                    except (Exception, SystemExit) as e: # sys.exit() in a worker
+                        self.failed[key] = e
+                        print(f"** {key} failed: {e!r}")
+                    finished(key)
+
+        counts = {lane: sum(1 for l, _, _, _ in self.tasks.values() if l == lane) for lane in LANES}
+        print(f"-- scheduler: {len(self.tasks)} tasks ({', '.join(f'{n} {l}' for l, n in counts.items())}) in {time.time() - t:.1f} s, {len(self.failed)} failed")
+
+        return self.results
@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+
+import config
+import polyline_decoder
+
+# Douglas-Peucker simplification of the tracks drawn on static maps, see map_maker.py.
+#
+# Vertices are ranked by the tolerance at which Douglas-Peucker would drop them, so that
+# simplifying to a tolerance and to a number of vertices are both thresholds on the same ranks,
+# shared by all the tracks of a map. Distances are computed with numpy, one segment at a time.
+
+def ranks(points, tolerance=0.0):
+    """
+    points: (n, 2) projected coordinates.
+    Returns n values, inf for the endpoints, 0 for vertices within tolerance of their segment.
+    """
+
+    n = len(points)
+    r = np.zeros(n)
+    if n == 0:
+        return r
+    r[0] = r[-1] = np.inf
+
+    stack = [(0, n - 1, np.inf)]
+
+    while stack:
+        first, last, parent_rank = stack.pop()
+        if last - first < 2:
+            continue
+
+        a, b = points[first], points[last]
+        inner = points[first+1:last] - a
+        ab = b - a
+        length = math.hypot(ab[0], ab[1])
+
+        if length == 0:
+            d = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            d = np.abs(ab[0] * inner[:, 1] - ab[1] * inner[:, 0]) / length
+
+        i = int(np.argmax(d))
+        rank = min(d[i], parent_rank) # never above the vertex that split the segment
+        if rank <= tolerance:
+            continue
+
+        k = first + 1 + i
+        r[k] = rank
+        stack.append((first, k, rank))
+        stack.append((k, last, rank))
+
+    return r
+
+def vertex_budget(width_px, height_px):
+    # about one vertex per pixel of the map sides, a track rarely shows more details
+    return width_px + height_px
+
+def simplify_tracks(tracks, size_px, budget):
+    """
+    Keeps at most budget vertices (plus the endpoints), and none closer than
+    config.MAP_SIMPLIFY_TOLERANCE_PX pixels to the simplified track.
+    tracks are (n, 2) arrays of lat / lon in 1e-5 degrees, see geometry.py.
+    size_px is (width, height) of the map, which fits all the tracks.
+    Returns (encoded polylines, number of vertices kept).
+    """
+
+    offsets = np.concatenate([[0], np.cumsum([len(t) for t in tracks])]).astype(int)
+    coords = np.concatenate(tracks) if tracks else np.zeros((0, 2), dtype=np.int64)
+    if len(coords) == 0:
+        return [""] * len(tracks), 0
+
+    # equirectangular projection, in degrees of latitude
+    lat0 = math.radians(coords[:, 0].mean() / polyline_decoder.FACTOR)
+    points = np.stack([coords[:, 1] * math.cos(lat0), coords[:, 0]], axis=1) / polyline_decoder.FACTOR
+
+    extent = points.max(axis=0) - points.min(axis=0)
+    degrees_per_px = max(extent[0] / size_px[0], extent[1] / size_px[1])
+    tolerance = config.MAP_SIMPLIFY_TOLERANCE_PX * degrees_per_px
+
+    all_ranks = np.concatenate([ranks(points[offsets[i]:offsets[i+1]], tolerance) for i in range(len(tracks))])
+
+    # the budget-th highest rank among the inner vertices becomes the threshold
+    inner = all_ranks[np.isfinite(all_ranks) & (all_ranks > 0)]
+    threshold = 0
+    if len(inner) > budget:
+        threshold = np.partition(inner, len(inner) - budget - 1)[len(inner) - budget - 1]
+    keep = (all_ranks > threshold) | np.isinf(all_ranks)
+
+    simplified = []
+    for i in range(len(tracks)):
+        c = coords[offsets[i]:offsets[i+1]][keep[offsets[i]:offsets[i+1]]]
+        simplified.append(polyline_decoder.encode(c))
+
+    return simplified, int(keep.sum())
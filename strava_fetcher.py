@@ -0,0 +1,244 @@
+import sys
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+import urllib3
+
+import config
+import transport
+
+# Concurrent download of the pages of /athlete/activities.
+#
+# Strava allows a number of requests per 15 minutes and per day, and reports the current usage in the
+# X-RateLimit-Usage / X-RateLimit-Limit headers ("short,daily"), and for read requests in
+# X-ReadRateLimit-Usage / X-ReadRateLimit-Limit. We keep track of them and wait for the next window
+# before sending a request that would exceed a limit, instead of waiting for a 429.
+#
+# https://developers.strava.com/docs/rate-limits/
+
+PER_PAGE = 200
+SHORT_WINDOW = 15 * 60
+DAILY_WINDOW = 24 * 60 * 60
+MAX_RETRIES = 5
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+class RateLimiter:
+
+    def __init__(self, margin=2):
+        self.lock = threading.Lock()
+        self.margin = margin # requests kept in reserve
+        self.buckets = []    # [((short_limit, daily_limit), (short_usage, daily_usage)), ...]
+        self.updated_at = 0
+        self.blocked_until = 0
+        self.in_flight = 0
+
+    def update(self, headers):
+        buckets = []
+        for prefix in ["X-RateLimit", "X-ReadRateLimit"]:
+            limits = parse_pair(headers.get(f"{prefix}-Limit"))
+            usage = parse_pair(headers.get(f"{prefix}-Usage"))
+            if limits and usage:
+                buckets.append((limits, usage))
+
+        if not buckets:
+            return
+
+        with self.lock:
+            self.buckets = buckets
+            self.updated_at = time.time()
+
+    def acquire(self):
+        # blocks until a request can be sent without exceeding the limits
+        while True:
+            with self.lock:
+                delay = self.delay()
+                if delay <= 0:
+                    self.in_flight += 1
+                    return
+            print(f"-- rate limit reached, waiting {int(delay)} s")
+            time.sleep(delay)
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def delay(self):
+        now = time.time()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        # usage counters are reset at the beginning of each 15 minutes window, and at midnight UTC
+        same_day = int(now // DAILY_WINDOW) == int(self.updated_at // DAILY_WINDOW)
+        same_window = int(now // SHORT_WINDOW) == int(self.updated_at // SHORT_WINDOW)
+
+        delay = 0
+        for (short_limit, daily_limit), (short_usage, daily_usage) in self.buckets:
+            if same_day and daily_usage + self.in_flight >= daily_limit - self.margin:
+                delay = max(delay, DAILY_WINDOW - now % DAILY_WINDOW)
+            if same_window and short_usage + self.in_flight >= short_limit - self.margin:
+                delay = max(delay, SHORT_WINDOW - now % SHORT_WINDOW)
+        return delay
+
+    def wait_for_window(self):
+        # after a 429, wait for the next 15 minutes window
+        with self.lock:
+            now = time.time()
+            self.blocked_until = now + SHORT_WINDOW - now % SHORT_WINDOW
+
+def parse_pair(s): # "100,1000"
+    if not s:
+        return None
+    try:
+        short, daily = s.split(",")
+        return int(short), int(daily)
+    except ValueError:
+        return None
+
+class Tokens:
+
+    def __init__(self, access_token, refresh_token):
+        self.lock = threading.Lock()
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.failed = False
+
+    def refresh(self, session, expired_access_token):
+        with self.lock:
+            if self.failed:
+                sys.exit(1) # already reported by another thread
+            if self.access_token != expired_access_token:
+                return # already refreshed by another thread
+
+            print("Access token expired, refreshing token...")
+            payload = {
+                'client_id': config.STRAVA_CLIENT_ID,
+                'client_secret': config.STRAVA_CLIENT_SECRET,
+                'grant_type': 'refresh_token',
+                'refresh_token': self.refresh_token
+            }
+            response = session.post(f"{config.STRAVA_API_URL}/oauth/token", data=payload, verify=False, timeout=30)
+            tokens = response.json() if response.status_code == 200 else {}
+
+            # eg. revoked access or wrong client secret
+            if 'access_token' not in tokens or 'refresh_token' not in tokens:
+                self.failed = True
+                print(f"(!) Access token could not be refreshed, status code {response.status_code}")
+                print(response.text)
+                print("(!) Check the Strava client ID and secret in config.py, then run 1_download_activities.py again to re-authorize")
+                sys.exit(1)
+
+            self.access_token, self.refresh_token = tokens['access_token'], tokens['refresh_token']
+
+def fetch_page(session, limiter, tokens, page, after):
+    """
+    Returns the list of activities of the page, or None if the page can't be fetched.
+    """
+
+    url = f"{config.STRAVA_API_URL}/athlete/activities"
+    param = {'per_page': PER_PAGE, 'page': page, 'after': after}
+
+    for attempt in range(MAX_RETRIES):
+
+        access_token = tokens.access_token
+        header = {'Authorization': 'Bearer ' + access_token}
+
+        limiter.acquire()
+        try:
+            response = session.get(url, headers=header, params=param, verify=False, timeout=60)
+        except requests.RequestException as e:
+            print(f"-- page {page}: {e}")
+            response = None
+        finally:
+            limiter.release()
+
+        if response is not None:
+            limiter.update(response.headers)
+            status = response.status_code
+
+            if status == 200:
+                return response.json()
+
+            if status == 401:
+                tokens.refresh(session, access_token)
+                continue
+
+            if status == 429:
+                print(f"-- page {page}: 429 Too Many Requests")
+                limiter.wait_for_window()
+                continue
+
+            if status < 500:
+                print(f"Error: received status code {status} for page {page}")
+                print(response.text)
+                return None
+
+            print(f"-- page {page}: status code {status}")
+
+        # transient error, exponential backoff with jitter
+        delay = 2 ** attempt + random.random()
+        print(f"-- page {page}: retrying in {delay:.1f} s")
+        time.sleep(delay)
+
+    print(f"Error: giving up on page {page}")
+    return None
+
+def fetch_pages(access_token, refresh_token, after, on_page, max_workers=None):
+    """
+    Fetches all the pages of activities after the `after` epoch, with at most max_workers requests in flight.
+    on_page(page, activities) is called from the main thread as soon as each page arrives.
+    Returns True if all pages were fetched.
+    """
+
+    if not max_workers:
+        max_workers = config.STRAVA_MAX_CONCURRENT_REQUESTS
+
+    session = transport.new_session(max_workers)
+    limiter = RateLimiter()
+    tokens = Tokens(access_token, refresh_token)
+
+    # the number of pages is unknown, so pages are requested in order, max_workers at a time,
+    # until a page comes back incomplete. The first page is requested alone, as incremental
+    # syncs usually fit in a single page.
+
+    window = 1
+    next_page = 1
+    last_page = None
+    success = True
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        while True:
+
+            while len(futures) < window and (last_page is None or next_page <= last_page) and success:
+                print(f"-- Fetching page {next_page}")
+                f = executor.submit(fetch_page, session, limiter, tokens, next_page, after)
+                futures[f] = next_page
+                next_page += 1
+
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+            for f in done:
+                page = futures.pop(f)
+                activities = f.result()
+
+                if activities is None:
+                    success = False
+                    continue
+
+                if len(activities) < PER_PAGE:
+                    last_page = page if last_page is None else min(last_page, page)
+                else:
+                    window = max_workers
+
+                if len(activities) > 0:
+                    on_page(page, activities)
+
+    return success
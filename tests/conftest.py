@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # modules read and write relative to the current directory, eg. pages/ and build_manifest.json
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,36 @@
+import os
+
+from PyPDF2 import PdfReader
+
+import book
+import config
+import page_decorations
+
+ACTIVITY_IDS = [[1], [2], [3], [4], [5]]
+
+def make_pages(activity_ids, index_pages=2):
+    for i, aids in enumerate(activity_ids):
+        joined_aids = '_'.join([str(aid) for aid in aids])
+        os.makedirs(f"{config.PAGES_DIR}/{joined_aids}", exist_ok=True)
+        page_decorations.create_empty_pages(f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf", i+1, 1)
+    page_decorations.create_empty_pages(book.INDEX_PDF, len(activity_ids)+1, index_pages)
+
+def page_count():
+    return len(PdfReader(book.OUTPUT_FILE).pages)
+
+def test_book_is_padded_to_a_multiple_of_4(workdir):
+    make_pages(ACTIVITY_IDS)
+    book.assemble_pages(ACTIVITY_IDS)
+    assert page_count() == 8 # 5 pages, 2 index pages, 1 empty page
+
+def test_index_only(workdir):
+    make_pages(ACTIVITY_IDS)
+    book.assemble_pages(ACTIVITY_IDS, index_only=True)
+    assert page_count() == 4 # 2 index pages, 2 empty pages
+
+def test_missing_page(workdir):
+    make_pages(ACTIVITY_IDS)
+    os.remove(f"{config.PAGES_DIR}/3/3.pdf")
+    book.assemble_pages(ACTIVITY_IDS)
+    assert page_count() == 8 # an empty page 3 keeps the numbers of the next pages
+    assert "3" in PdfReader(book.OUTPUT_FILE).pages[2].extract_text()
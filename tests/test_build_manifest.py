@@ -0,0 +1,96 @@
+import os
+
+import build_manifest
+import config
+
+ACTIVITY_IDS = [[1], [2]]
+
+def make_page(joined_aids, pdf=True):
+    os.makedirs(f"{config.PAGES_DIR}/{joined_aids}", exist_ok=True)
+    with open(f"{config.PAGES_DIR}/{joined_aids}/_meta_.json", "w") as f:
+        f.write('{"Titre": "%s"}' % joined_aids)
+    if pdf:
+        with open(f"{config.PAGES_DIR}/{joined_aids}/{joined_aids}.pdf", "w") as f:
+            f.write("%PDF")
+
+def test_outdated_pages(workdir):
+    make_page("1")
+    make_page("2")
+    manifest = build_manifest.load()
+
+    # rendered before page numbers were drawn
+    assert build_manifest.outdated_pages(ACTIVITY_IDS, manifest, 5) == [[1], [2]]
+
+    manifest["rendered"] = {"1": [5, 1], "2": [5, 1]}
+    assert build_manifest.outdated_pages(ACTIVITY_IDS, manifest, 5) == [[2]]
+    assert build_manifest.outdated_pages(ACTIVITY_IDS, manifest, 6) == [[1], [2]]
+
+    os.remove(f"{config.PAGES_DIR}/1/1.pdf")
+    assert build_manifest.outdated_pages(ACTIVITY_IDS, manifest, 5) == [[1], [2]]
+
+def test_stale_pages(workdir):
+    make_page("1")
+    make_page("2")
+    manifest = build_manifest.load()
+
+    stale, fingerprints = build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)
+    assert stale == [[1], [2]] # never rendered
+
+    manifest["pages"].update(fingerprints)
+    assert build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[0] == []
+
+    # an input of page 2 changed
+    with open(f"{config.PAGES_DIR}/2/_meta_.json", "w") as f:
+        f.write('{"Titre": "edited"}')
+    assert build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[0] == [[2]]
+
+def test_stale_pages_renderer_and_numbers(workdir):
+    make_page("1")
+    make_page("2")
+    manifest = build_manifest.load()
+    manifest["pages"].update(build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[1])
+
+    assert build_manifest.stale_pages(ACTIVITY_IDS, manifest, 6)[0] == [[1], [2]]
+    assert build_manifest.stale_pages([[2], [1]], manifest, 5)[0] == [[2], [1]] # page numbers changed
+
+def test_missing_pdf_is_stale(workdir):
+    make_page("1")
+    make_page("2", pdf=False)
+    manifest = build_manifest.load()
+    manifest["pages"].update(build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[1])
+
+    assert build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[0] == [[2]]
+
+def test_new_dem_tiles_make_pages_stale(workdir, monkeypatch):
+    monkeypatch.setattr(config, "ELEVATION_BACKEND", "dem")
+    monkeypatch.setattr(config, "DEM_DIR", "dem")
+    make_page("1")
+    make_page("2")
+    manifest = build_manifest.load()
+    manifest["pages"].update(build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[1])
+
+    os.makedirs("dem")
+    with open("dem/N46E007.hgt", "wb") as f:
+        f.write(b"\0\0")
+    assert build_manifest.stale_pages(ACTIVITY_IDS, manifest, 5)[0] == [[1], [2]]
+
+def test_moved_full_page_is_not_stale(workdir):
+    make_page("1")
+    make_page("cover")
+    manifest = build_manifest.load()
+    manifest["pages"].update(build_manifest.stale_pages([[1], ["cover"]], manifest, 5)[1])
+    manifest["rendered"] = {"1": [5, 1], "cover": [5, None]}
+
+    # no page number on full page photos
+    assert build_manifest.stale_pages([["cover"], [1]], manifest, 5)[0] == [[1]]
+    assert build_manifest.outdated_pages([["cover"], [1]], manifest, 5) == [[1]]
+
+def test_page_fingerprints_of_selected_pages(workdir):
+    make_page("1")
+    make_page("2")
+    manifest = build_manifest.load()
+
+    fingerprints = build_manifest.page_fingerprints(ACTIVITY_IDS, manifest, 5)
+    selected = build_manifest.page_fingerprints(ACTIVITY_IDS, manifest, 5, [[2]])
+
+    assert selected == {"2": fingerprints["2"]} # with its page number
@@ -0,0 +1,70 @@
+import json
+import os
+
+import config
+import catalog
+import json_utils
+
+def touch_later(path):
+    # a distinct mtime, whatever the resolution of the file system
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+def test_edited_meta_wins_over_catalog(workdir, monkeypatch):
+    monkeypatch.setattr(config, "CATALOG_FILE", str(workdir / "catalog.sqlite"))
+    os.makedirs("pages/1")
+    json_utils.dump({"Titre": "old"}, "pages/1/_meta_.json")
+    catalog.import_layout(catalog.connect())
+
+    assert json_utils.load_meta_for_aids([1]) == {"Titre": "old"}
+
+    with open("pages/1/_meta_.json", "w") as f:
+        json.dump({"Titre": "new"}, f)
+    touch_later("pages/1/_meta_.json")
+
+    assert json_utils.load_meta_for_aids([1]) == {"Titre": "new"}
+    assert catalog.load_meta(catalog.connect(), "1") == {"Titre": "new"}
+
+def test_new_cleanup_is_imported(workdir, monkeypatch):
+    monkeypatch.setattr(config, "CATALOG_FILE", str(workdir / "catalog.sqlite"))
+    os.makedirs("pages")
+    json_utils.dump_jsonl([{"id": 1, "start_date_local": "2022-01-01"}], json_utils.ACTIVITIES_CLEAN_JSONL)
+    catalog.import_layout(catalog.connect())
+
+    json_utils.dump_jsonl([{"id": 2, "start_date_local": "2022-01-02"}], json_utils.ACTIVITIES_CLEAN_JSONL)
+    touch_later(json_utils.ACTIVITIES_CLEAN_JSONL)
+
+    assert [a["id"] for a in json_utils.iter_activities()] == [2]
+
+def test_export_then_import(workdir, monkeypatch):
+    monkeypatch.setattr(config, "CATALOG_FILE", str(workdir / "catalog.sqlite"))
+    os.makedirs("pages/1")
+    os.makedirs("elevations_cache")
+    json_utils.dump_jsonl([{"id": 1, "start_date_local": "2022-01-01"}], json_utils.ACTIVITIES_CLEAN_JSONL)
+    json_utils.dump({"Titre": "one"}, "pages/1/_meta_.json")
+    json_utils.dump([1, 2, 3], "elevations_cache/abc.json")
+    conn = catalog.connect()
+    catalog.import_layout(conn)
+
+    os.remove("pages/1/_meta_.json")
+    os.remove("elevations_cache/abc.json")
+    catalog.export_layout(conn)
+
+    assert json_utils.load("pages/1/_meta_.json") == {"Titre": "one"}
+    assert json_utils.load("elevations_cache/abc.json") == [1, 2, 3]
+
+def test_failed_import_leaves_catalog_untouched(workdir, monkeypatch):
+    monkeypatch.setattr(config, "CATALOG_FILE", str(workdir / "catalog.sqlite"))
+    os.makedirs("pages")
+    json_utils.dump_jsonl([{"id": 1, "start_date_local": "2022-01-01"}], json_utils.ACTIVITIES_CLEAN_JSONL)
+    conn = catalog.connect()
+    catalog.import_layout(conn)
+
+    json_utils.dump_jsonl([{"id": 2, "start_date_local": "2022-01-02"}], json_utils.ACTIVITIES_CLEAN_JSONL)
+    os.rmdir("pages")
+    try:
+        catalog.import_layout(conn)
+    except FileNotFoundError:
+        pass
+
+    assert [a["id"] for a in catalog.iter_activities(conn)] == [1]
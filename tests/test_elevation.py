@@ -0,0 +1,28 @@
+import threading
+import time
+
+import config
+import elevation
+
+POLYLINE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+def test_identical_polylines_fetched_once(workdir, monkeypatch):
+    monkeypatch.setattr(config, "ELEVATION_BACKEND", "stadia")
+    fetches = []
+
+    def fetch_elevations(polyline, session=None):
+        fetches.append(polyline)
+        time.sleep(0.1)
+        return [1, 2, 3]
+
+    monkeypatch.setattr(elevation, "fetch_elevations", fetch_elevations)
+
+    threads = [threading.Thread(target=elevation.get_elevations, args=(POLYLINE,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fetches == [POLYLINE]
+    assert elevation.read_elevations(POLYLINE) == [1, 2, 3]
+    assert elevation._inflight_locks == {} # no lock left behind, eg. with book.py --watch
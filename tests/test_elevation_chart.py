@@ -0,0 +1,15 @@
+import elevation_chart
+
+def test_one_altitude_per_column():
+    xs, altitudes, starts = elevation_chart.altitudes_from_elevations_lists([[1, 2, 3], [5, 6]], [1000, 1000], 200)
+    assert len(xs) == len(altitudes)
+    assert xs.max() == 199
+    assert list(starts) == [0, 101]
+
+def test_zero_distance_activity():
+    xs, altitudes, starts = elevation_chart.altitudes_from_elevations_lists([[1, 2, 3], [5, 6]], [1000, 0], 200)
+    assert len(altitudes) == 200
+    assert list(starts) == [0, 200]
+
+def test_smooth_nothing():
+    assert len(elevation_chart.smooth_altitudes([])) == 0
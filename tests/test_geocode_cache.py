@@ -0,0 +1,20 @@
+import threading
+
+import geocode_cache
+
+def test_one_cache_for_all_threads(workdir, monkeypatch):
+    monkeypatch.setattr(geocode_cache, "_cache", None)
+    caches = []
+    start = threading.Barrier(8)
+
+    def get():
+        start.wait()
+        caches.append(geocode_cache.get_cache())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(c) for c in caches}) == 1
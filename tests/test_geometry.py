@@ -0,0 +1,33 @@
+import os
+
+import elevation
+import geometry
+
+POLYLINE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@" # 3 points
+
+def rewrite_elevations(elevations):
+    path = elevation.elevations_path(POLYLINE)
+    mtime_ns = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    elevation.save_elevations(elevations, POLYLINE)
+    os.utime(path, ns=(mtime_ns + 1_000_000_000, mtime_ns + 1_000_000_000)) # a distinct mtime
+
+def test_cached_geometry_without_elevations(workdir):
+    g = geometry.load(1, POLYLINE, "1")
+    assert len(g) == 3
+    assert len(g.elevations) == 0
+    assert geometry.read(1, POLYLINE) is not None
+
+def test_cached_elevations_follow_their_file(workdir):
+    rewrite_elevations([100, 200, 300])
+    assert list(geometry.load(1, POLYLINE, "1").elevations) == [100, 200, 300]
+    assert list(geometry.read(1, POLYLINE, "1").elevations) == [100, 200, 300]
+
+    # fetched again or corrected
+    rewrite_elevations([110, 210, 310])
+    assert len(geometry.read(1, POLYLINE, "1").elevations) == 0
+    assert list(geometry.load(1, POLYLINE, "1").elevations) == [110, 210, 310]
+    assert list(geometry.read(1, POLYLINE, "1").elevations) == [110, 210, 310]
+
+def test_other_polyline_is_not_read(workdir):
+    geometry.load(1, POLYLINE, "1")
+    assert geometry.read(1, "_p~iF~ps|U") is None
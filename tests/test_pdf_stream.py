@@ -0,0 +1,29 @@
+from PyPDF2 import PdfReader
+
+import page_decorations
+import pdf_stream
+
+def test_identical_objects_are_written_once(workdir):
+    page_decorations.create_empty_pages("a.pdf", 1, 2)
+    page_decorations.create_empty_pages("b.pdf", 3, 1)
+
+    with pdf_stream.BookWriter("book.pdf") as book:
+        assert book.add_pdf("a.pdf") == 2
+        assert book.add_pdf("b.pdf") == 1
+
+    assert book.duplicates > 0 # fonts and cut marks of b.pdf
+    reader = PdfReader("book.pdf")
+    assert len(reader.pages) == 3
+    assert "3" in reader.pages[2].extract_text()
+
+def test_interrupted_book_is_not_written(workdir):
+    page_decorations.create_empty_pages("a.pdf", 1, 1)
+
+    try:
+        with pdf_stream.BookWriter("book.pdf") as book:
+            book.add_pdf("a.pdf")
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+
+    assert not (workdir / "book.pdf").exists()
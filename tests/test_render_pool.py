@@ -0,0 +1,28 @@
+import os
+
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+import render_pool
+
+def noop():
+    pass
+
+@pytest.fixture(autouse=True)
+def plain_workers(monkeypatch):
+    # the render workers set up fonts, icons and the locale of the book
+    monkeypatch.setattr(render_pool, "init_worker", noop)
+    yield
+    render_pool.shutdown(wait=False)
+
+def test_new_pool_after_a_worker_died():
+    with pytest.raises(BrokenProcessPool):
+        render_pool.submit(os._exit, 1).result()
+
+    assert render_pool.submit(pow, 3, 2).result() == 9
+
+def test_starmap_after_a_worker_died():
+    with pytest.raises(BrokenProcessPool):
+        render_pool.starmap(os._exit, [(1,)])
+
+    assert render_pool.starmap(pow, [(3, 2), (2, 3)]) == [9, 8]
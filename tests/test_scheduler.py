@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import render_pool
+import scheduler
+
+@pytest.fixture(autouse=True)
+def cpu_pool(monkeypatch):
+    # plain workers, the render workers set up fonts, icons and the locale of the book
+    pool = ProcessPoolExecutor(max_workers=1)
+    monkeypatch.setattr(render_pool, "executor", lambda: pool)
+    yield pool
+    pool.shutdown()
+
+def test_dependencies_and_main_lane_order(workdir):
+    order = []
+
+    def fetch(name, delay):
+        time.sleep(delay)
+        order.append(name)
+        return name
+
+    def add(name):
+        order.append(f"add {name}")
+
+    s = scheduler.Scheduler(io_workers=2)
+    slow = s.add("fetch slow", "io", fetch, "slow", 0.2)
+    fast = s.add("fetch fast", "io", fetch, "fast", 0)
+    squared = s.add("square", "cpu", pow, 3, 2)
+    first = s.add("add slow", "main", add, "slow", deps=[slow])
+    s.add("add fast", "main", add, "fast", deps=[fast, first, squared])
+
+    results = s.run()
+
+    assert results["square"] == 9
+    # in order, although the second fetch completed first
+    assert order == ["fast", "slow", "add slow", "add fast"]
+
+def test_failed_task_still_runs_dependents(workdir):
+
+    def fail():
+        raise ValueError("no network")
+
+    s = scheduler.Scheduler()
+    fetch = s.add("fetch", "io", fail)
+    s.add("render", "main", lambda: "rendered", deps=[fetch])
+
+    results = s.run()
+
+    assert isinstance(s.failed["fetch"], ValueError)
+    assert results["render"] == "rendered"
+    assert "fetch" not in results
@@ -0,0 +1,41 @@
+import pytest
+
+import strava_fetcher
+
+class Response:
+
+    def __init__(self, status_code, tokens):
+        self.status_code = status_code
+        self.tokens = tokens
+        self.text = str(tokens)
+
+    def json(self):
+        return self.tokens
+
+class Session:
+
+    def __init__(self, response):
+        self.response = response
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        return self.response
+
+def test_refresh():
+    tokens = strava_fetcher.Tokens("a", "r")
+    tokens.refresh(Session(Response(200, {"access_token": "a2", "refresh_token": "r2"})), "a")
+    assert (tokens.access_token, tokens.refresh_token) == ("a2", "r2")
+
+def test_refresh_refused(capsys):
+    tokens = strava_fetcher.Tokens("a", "r")
+    session = Session(Response(401, {"message": "Bad Request"}))
+
+    with pytest.raises(SystemExit):
+        tokens.refresh(session, "a")
+    assert "re-authorize" in capsys.readouterr().out
+
+    # other threads stop without asking again
+    with pytest.raises(SystemExit):
+        tokens.refresh(session, "a")
+    assert session.posts == 1
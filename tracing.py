@@ -0,0 +1,200 @@
+import functools
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Build tracing, off unless book.py runs with --trace or --profile.
+#
+# Spans (timed sections) and counters are appended as they happen to one file per process,
+# TRACE_DIR/events_{pid}.jsonl, so that render workers keep their events without any shutdown step.
+# merge() then writes TRACE_DIR/trace.json in the Chrome trace format (chrome://tracing, https://ui.perfetto.dev)
+# and prints totals per span and counter.
+#
+# With --profile, each process also runs cProfile, saved to TRACE_DIR/profile_{pid}.prof after each
+# top level span of its main thread, and merge() sums them up in TRACE_DIR/profile.prof.
+#
+# Settings go through environment variables, so that workers started by spawn get them too.
+# cProfile and pstats are imported only when profiling, book.py imports this module on startup.
+
+TRACE_DIR = "traces"
+TRACE_DIR_ENV = "STRAVABOOK_TRACE_DIR"
+PROFILE_ENV = "STRAVABOOK_PROFILE"
+
+_pid = None # process the state below belongs to, see init_process()
+_lock = threading.Lock()
+_file = None
+_file_pid = None
+_local = threading.local() # span depth per thread
+_profiler = None
+
+def enabled():
+    return TRACE_DIR_ENV in os.environ
+
+def trace_dir():
+    return os.environ[TRACE_DIR_ENV]
+
+def enable(profile=False, directory=TRACE_DIR):
+
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(f"{directory}/events_*.jsonl") + glob.glob(f"{directory}/profile_*.prof"):
+        os.remove(path) # from a previous build
+
+    os.environ[TRACE_DIR_ENV] = directory
+    if profile:
+        os.environ[PROFILE_ENV] = "1"
+
+    init_process()
+
+def init_process():
+    # in every process, before its first span, see render_pool.init_worker()
+
+    global _pid, _lock, _local, _profiler
+
+    if _pid == os.getpid():
+        return
+
+    # forked workers start from a copy of the state of the thread that forked
+    _pid = os.getpid()
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+
+    if enabled() and PROFILE_ENV in os.environ:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def _dump_profile():
+    # dump_stats() stops the profiler
+    _profiler.dump_stats(f"{trace_dir()}/profile_{os.getpid()}.prof")
+    _profiler.enable()
+
+def _write(event):
+
+    global _file, _file_pid
+
+    with _lock:
+        if _file_pid != os.getpid(): # forked workers write their own file
+            _file = open(f"{trace_dir()}/events_{os.getpid()}.jsonl", "a", buffering=1)
+            _file_pid = os.getpid()
+        _file.write(json.dumps(event) + "\n")
+
+def complete(name, start, duration, cat="build", **args):
+    # a span measured by the caller, start in seconds since the epoch
+
+    if not enabled():
+        return
+
+    _write({"name": name, "cat": cat, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+def count(name, n=1):
+
+    if not enabled() or n == 0:
+        return
+
+    _write({"name": name, "ph": "C", "ts": time.time() * 1e6, "pid": os.getpid(), "n": n})
+
+@contextmanager
+def span(name, cat="build", **args):
+    """
+    with tracing.span("render", page=joined_aids) as args:
+        args["bytes"] = ... # optional, recorded with the span
+    """
+
+    if not enabled():
+        yield args
+        return
+
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+
+    start = time.time()
+    cpu = time.thread_time()
+
+    try:
+        yield args
+    finally:
+        _local.depth = depth
+        args["cpu_ms"] = round((time.thread_time() - cpu) * 1000, 1)
+        complete(name, start, time.time() - start, cat, **args)
+
+        if depth == 0 and _profiler is not None and _pid == os.getpid() and threading.current_thread() is threading.main_thread():
+            _dump_profile()
+
+def traced(name, cat="build"):
+    # decorator, the arguments of the call are recorded with the span
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return fn(*args, **kwargs)
+            with span(name, cat, args=repr(args)[:200]):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+def merge():
+    """
+    Writes TRACE_DIR/trace.json out of the events of all the processes, and prints a summary.
+    """
+
+    if not enabled():
+        return
+
+    directory = trace_dir()
+
+    if _profiler is not None and _pid == os.getpid():
+        _dump_profile()
+
+    events = []
+    for path in glob.glob(f"{directory}/events_*.jsonl"):
+        with open(path) as f:
+            events += [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda e: e["ts"])
+
+    spans = {} # name -> [count, wall ms, cpu ms]
+    counters = {} # name -> total
+    trace_events = []
+
+    for pid in sorted({e["pid"] for e in events}):
+        process_name = "main" if pid == os.getpid() else f"worker {pid}"
+        trace_events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}})
+
+    for e in events:
+        if e["ph"] == "C":
+            # increments become running totals, one track per counter
+            counters[e["name"]] = counters.get(e["name"], 0) + e["n"]
+            trace_events.append({"name": e["name"], "ph": "C", "ts": e["ts"], "pid": os.getpid(), "args": {"total": counters[e["name"]]}})
+        else:
+            s = spans.setdefault(e["name"], [0, 0, 0])
+            s[0] += 1
+            s[1] += e["dur"] / 1000
+            s[2] += e["args"].get("cpu_ms", 0)
+            trace_events.append(e)
+
+    path = f"{directory}/trace.json"
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+    print(f"-- trace: {path}, {len(events)} events")
+    for name, (n, wall, cpu) in sorted(spans.items(), key=lambda s: -s[1][1]):
+        print(f"   {name:<20} {n:6} x  {wall:10.0f} ms  {cpu:10.0f} ms cpu")
+    for name, total in sorted(counters.items()):
+        print(f"   {name:<30} {total}")
+
+    profiles = glob.glob(f"{directory}/profile_*.prof")
+    if profiles:
+        import pstats
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(f"{directory}/profile.prof")
+        print(f"-- profile: {directory}/profile.prof, {len(profiles)} processes")
+        stats.sort_stats("cumulative").print_stats(15)
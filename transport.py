@@ -0,0 +1,136 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import tracing
+
+# HTTP sessions shared by the modules calling web APIs (Strava, MapTiler, Stadia), to reuse connections (keep-alive).
+#
+# config.HTTP_MODE:
+# - "live":   requests go to the services
+# - "record": requests go to the services, and responses are saved in config.HTTP_CASSETTES_DIR
+# - "replay": requests go to replay_server.py (config.HTTP_REPLAY_URL), which serves the saved responses,
+#             so that the whole pipeline runs offline and deterministically
+#
+# Responses are keyed by method, host, path and parameters, without API keys and tokens.
+#
+# With tracing on, each response is recorded as an "http" span, with its size (see tracing.py).
+
+SECRET_PARAMS = {"key", "api_key", "access_token", "refresh_token", "client_id", "client_secret", "code"}
+
+RECORDED_HEADERS = ["Content-Type", "X-RateLimit-Limit", "X-RateLimit-Usage", "X-ReadRateLimit-Limit", "X-ReadRateLimit-Usage"]
+
+def cassette_key(method, host_and_path, query, body=None):
+    # query and body are urlencoded strings
+    params = [(k, v) for k, v in parse_qsl(query or "", keep_blank_values=True) if k not in SECRET_PARAMS]
+    if body:
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', errors='replace')
+        params += [("body:" + k, v) for k, v in parse_qsl(body, keep_blank_values=True) if k not in SECRET_PARAMS]
+    s = f"{method.upper()} {host_and_path}?{urlencode(sorted(params))}"
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+def cassette_path(key):
+    return f"{config.HTTP_CASSETTES_DIR}/{key}.json"
+
+class RecordingSession(requests.Session):
+
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        if response.status_code != 429 and response.status_code < 500: # transient errors are injected by the replay server
+            save_cassette(response)
+        return response
+
+class ReplaySession(requests.Session):
+
+    def request(self, method, url, **kwargs):
+        # https://api.maptiler.com/geocoding/... -> {HTTP_REPLAY_URL}/api.maptiler.com/geocoding/...
+        parts = urlsplit(url)
+        replay_url = f"{config.HTTP_REPLAY_URL}/{parts.netloc}{parts.path}"
+        if parts.query:
+            replay_url += "?" + parts.query
+        kwargs["verify"] = False
+        return super().request(method, replay_url, **kwargs)
+
+def save_cassette(response):
+
+    request = response.request
+    parts = urlsplit(request.url)
+    key = cassette_key(request.method, parts.netloc + parts.path, parts.query, request.body)
+
+    redacted_query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS])
+
+    cassette = {
+        "request": {"method": request.method, "url": f"{parts.scheme}://{parts.netloc}{parts.path}?{redacted_query}"},
+        "status": response.status_code,
+        "headers": {h: response.headers[h] for h in RECORDED_HEADERS if h in response.headers},
+        "body": base64.b64encode(response.content).decode('ascii')
+    }
+
+    os.makedirs(config.HTTP_CASSETTES_DIR, exist_ok=True)
+    tmp_path = f"{cassette_path(key)}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cassette, f, indent=4)
+    os.replace(tmp_path, cassette_path(key))
+
+def load_cassette(key):
+    path = cassette_path(key)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        cassette = json.load(f)
+    cassette["body"] = base64.b64decode(cassette["body"])
+    return cassette
+
+def trace_response(response, *args, **kwargs):
+    # response hook, called once the headers are read: the body is read here to time its download
+
+    if not tracing.enabled():
+        return
+
+    start = time.time() - response.elapsed.total_seconds()
+    size = 0 if kwargs.get("stream") else len(response.content)
+    parts = urlsplit(response.url)
+
+    tracing.complete("http", start, time.time() - start, cat="network",
+                     host=parts.netloc, path=parts.path, status=response.status_code, bytes=size)
+    tracing.count("http requests")
+    tracing.count("http bytes", size)
+
+def new_session(pool_size=10, retries=None):
+    # retries: optional urllib3 Retry, applied by the connection pool
+
+    if config.HTTP_MODE == "record":
+        session = RecordingSession()
+    elif config.HTTP_MODE == "replay":
+        session = ReplaySession()
+    else:
+        session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries or 0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(trace_response)
+    return session
+
+def needs_api_keys():
+    return config.HTTP_MODE != "replay"
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+def default_session():
+    # for calls made without a session of their own
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = new_session()
+        return _default_session